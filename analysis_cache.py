@@ -0,0 +1,162 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+CACHE_DIR = os.environ.get('GRADER_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache'))
+ANALYSIS_CACHE_MAX_BYTES = int(os.environ.get('ANALYSIS_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+
+
+class Uncached(str):
+    """A result that is returned to the caller but not stored, e.g. one produced by a degraded fallback."""
+
+
+def make_key(*parts):
+    """Hash the given parts into a cache key; parts are length-prefixed so they cannot run together."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        digest.update(str(len(part)).encode('ascii') + b':' + part)
+    return digest.hexdigest()
+
+
+class SQLiteLRUCache:
+    """A persistent string cache stored in SQLite and evicted least-recently-used by total size."""
+
+    def __init__(self, path, max_bytes, name='cache'):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.name = name
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM entries WHERE key=?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                metrics.increment(f"{self.name}_misses")
+                return None
+            self.hits += 1
+            metrics.increment(f"{self.name}_hits")
+            self._conn.execute("UPDATE entries SET last_used=? WHERE key=?", (time.time(), key))
+            return row[0]
+
+    def set(self, key, value):
+        size = len(value.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time()),
+            )
+            self._evict()
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM entries WHERE key=?", (key,))
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+            self.hits = 0
+            self.misses = 0
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute("SELECT key, size FROM entries ORDER BY last_used ASC").fetchall()
+        evicted = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM entries WHERE key=?", evicted)
+        logging.info("Evicted %d entries from %s", len(evicted), self.path)
+
+    def stats(self):
+        with self._lock:
+            entries, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries, 'bytes': total}
+
+
+_key_locks = {}
+_key_locks_lock = threading.Lock()
+
+
+@contextmanager
+def key_lock(key):
+    """Serialise work on one cache key, so concurrent requests for the same content compute it only once."""
+    with _key_locks_lock:
+        lock, holders = _key_locks.get(key, (threading.Lock(), 0))
+        _key_locks[key] = (lock, holders + 1)
+    try:
+        with lock:
+            yield
+    finally:
+        with _key_locks_lock:
+            lock, holders = _key_locks[key]
+            if holders == 1:
+                del _key_locks[key]
+            else:
+                _key_locks[key] = (lock, holders - 1)
+
+
+_analysis_cache = None
+_result_cache = None
+_caches_lock = threading.Lock()
+
+
+def get_analysis_cache():
+    """Return the process-wide syntax-analysis cache."""
+    global _analysis_cache
+    with _caches_lock:
+        if _analysis_cache is None:
+            _analysis_cache = SQLiteLRUCache(os.path.join(CACHE_DIR, 'analysis.sqlite3'), ANALYSIS_CACHE_MAX_BYTES, 'analysis_cache')
+        return _analysis_cache
+
+
+def get_result_cache():
+    """Return the process-wide cache of complete grading reports."""
+    global _result_cache
+    with _caches_lock:
+        if _result_cache is None:
+            _result_cache = SQLiteLRUCache(os.path.join(CACHE_DIR, 'results.sqlite3'), RESULT_CACHE_MAX_BYTES, 'result_cache')
+        return _result_cache
+
+
+def cached_analysis(kind, version, content, compute):
+    """Return the analysis of content for the given checker kind/version, computing it only on a cache miss.
+
+    Exceptions raised by compute and Uncached results are not stored, so transient validator
+    failures are retried next time. Concurrent calls for the same body wait for the first one.
+    """
+    cache = get_analysis_cache()
+    key = make_key(kind, version, content)
+    with key_lock(key):
+        result = cache.get(key)
+        if result is None:
+            result = compute()
+            if isinstance(result, Uncached):
+                return str(result)
+            cache.set(key, result)
+    return result
@@ -1,64 +1,27 @@
-import random
 import streamlit as st
-import openai
-import pandas as pd
-import hashlib
+import io
 import os
 import time
-from azure.cosmos.exceptions import CosmosHttpResponseError
-from azure.cosmos import CosmosClient, PartitionKey
 import logging
 from dotenv import load_dotenv
-from grader import syntax_check
+import metrics
 
 # Securely load environment variables
 load_dotenv()
-url = os.environ['COSMOS_DB_URL']  # Cosmos DB URL
-database_name = os.environ['COSMOS_DB_DATABASE']  # Database name
-
-def randomize_openai_api_settings():
-    """Randomize the OpenAI API key."""
-    settings = [
-        {
-            "api_key": "AZURE_OPENAI_API_KEY",
-            "model": "AZURE_OPENAI_MODEL",
-            "endpoint": "AZURE_OPENAI_ENDPOINT"
-        },
-        {
-            "api_key": "AZURE_OPENAI_API_KEY_UK",
-            "model": "AZURE_OPENAI_MODEL_UK",
-            "endpoint": "AZURE_OPENAI_ENDPOINT_UK"
-        }
-    ]
-    return random.choice(settings)
-
-openai_settings = randomize_openai_api_settings()
-azure_openai_api_key = os.environ.get(openai_settings["api_key"])
-azure_openai_model = os.environ.get(openai_settings["model"])
-azure_openai_endpoint = os.environ.get(openai_settings["endpoint"])
-
-openai.api_version = "2023-05-15"
-openai.api_type = "azure"
-openai.api_key = azure_openai_api_key
-openai.api_base = azure_openai_endpoint
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
-SYSTEM_PROMPT = """
-You are an auto grader for web programing courses. You will be given the student codes, compilation results and rubric as well as extra information if any.
-Do not be strict on comment and syntax style. For example if the task is to add the student name and date as a comment, accept any commenting style
-and any name and dates that are not placeholders. Example of placeholder that should not be accepted are 'first name last name', 'MM/DD/YYYY', 'your name', 'today's date'
-Example of acceptable name and date 'John Sminth', 'Hsung Tsai', '2/2/2000'. Remember, you can not verify the actual date and name or uploading task, so accept anything that is not an obvious placeholder;
-Acceot tasks that you do not have the tools to verify and note that you were not able to actually verify it.
-Fill out the rubric and provide justification for your grading. Refer to the line number with error when possible. Always show the achieved score in bold number. Never add up the total grade or do any math.
-Provide these extra information afterward when aplicable, like compile error, tips to manually grade this submission for instructor, feedback for student.\n
-Example:
-1. {First rubric item} [Possible Score:{First possible score}] .\n- **Score: 1/1** {Justification and reasoning}\n\n
-2. {Second rubric item} [Possible Score:{Second possible score}]\n- **Score: 2/3** {Justification and reasoning}\n\n
-3. {Third rubric item} [Possible Score:{Third possilbe score}]\n- **Score: 3/3** {Justification and reasoning}\n\n
-Addtional information: {Compile error}\n {Manual grading tips for instructor}\n {feedback for student}\n
-"""
+# Expose /metrics for Prometheus when GRADER_METRICS_PORT is set; once per process despite reruns
+metrics.start_metrics_server()
+
+# The Cosmos SDK and the grading stack (OpenAI, validators, cssutils) are imported where they are
+# first needed, so the login page renders without them; the clients they create are process-wide.
+
+@st.cache_resource(show_spinner="Starting the grader...")
+def get_grading_queue():
+    from job_queue import get_job_queue
+    return get_job_queue()
 
 CHAPTER_DICT = {
     "Carey New Perspectives on HTML 5 and CSS: Comprehensive 8e": ["", "1", "2", "3", "4", "5", "6", "7", "8", "9", "10"],
@@ -99,128 +62,6 @@ EXERCISE_DICT = {
         "14":["", "cp01", "cp02", "cp03", "cp04", "rw01"]}
     }
 
-def fetch_prompt(book_title, chapter, exercise):
-    # Azure Cosmos DB configuration
-    
-    key = os.environ['COSMOS_DB_KEY']  # Cosmos DB primary key
-    container_name = os.environ['COSMOS_DB_PROMPT_CONTAINER']  # Container name
-
-    try:
-        # Create a Cosmos client
-        client = CosmosClient(url, credential=key)
-
-        # Select the database and container
-        database = client.get_database_client(database_name)
-        container = database.get_container_client(container_name)
-
-        # Query to fetch the exercise
-        query = "SELECT * FROM c WHERE c.title=@book_title AND c.chapter=@chapter AND c.ex=@exercise"
-        parameters = [
-            {"name": "@book_title", "value": book_title},
-            {"name": "@chapter", "value": chapter},
-            {"name": "@exercise", "value": exercise}
-        ]
-        items = list(container.query_items(
-            query=query,
-            parameters=parameters,
-            enable_cross_partition_query=True
-        ))
-
-        if items:
-            return items[0]
-        else:
-            return None
-
-    except CosmosHttpResponseError as e:
-        logging.error("Cosmos DB error: %s", str(e))
-        return None, None
-
-def grade_submission(file, prompt):
-    try:
-        grading_reports, raw_file_texts = syntax_check(file, azure_openai_model)
-
-        messages=[{"role": "system", "content": SYSTEM_PROMPT}]
-        
-        messages.append({"role": "user", "content": "You are grading the following file(s):"})
-        for filename in raw_file_texts:
-            messages.append({"role": "user", "content": f"File: {filename}"})
-            messages.append({"role": "user", "content": raw_file_texts[filename]})
-            if grading_reports[filename] != "":
-                messages.append({"role": "system", "content": "This is a syntax analysis of the file" + grading_reports[filename]})
-
-        messages.append({"role": "user", "content": "This is the rubric :" + prompt})
-
-        response = openai.ChatCompletion.create(
-            messages=messages,
-            engine=azure_openai_model,
-            
-        )
-        return response['choices'][0]['message']['content']
-    except Exception as e:
-        logging.error("OpenAI API error: %s", str(e))
-        return "Error in grading (%s)" % str(e)
-    
-def grade_submission_stream(file, prompt):
-    try:
-        grading_reports, raw_file_texts = syntax_check(file, azure_openai_model)
-
-        messages=[{"role": "system", "content": SYSTEM_PROMPT}]
-        
-        messages.append({"role": "user", "content": "You are grading the following file(s):"})
-        for filename in raw_file_texts:
-            messages.append({"role": "user", "content": f"File: {filename}"})
-            messages.append({"role": "user", "content": raw_file_texts[filename]})
-            if grading_reports[filename] != "":
-                messages.append({"role": "system", "content": "This is a syntax analysis of the file" + grading_reports[filename]})
-
-        messages.append({"role": "user", "content": "This is the rubric :" + prompt})
-
-        stream = openai.ChatCompletion.create(
-            messages=messages,
-            engine=azure_openai_model,
-            stream=True
-        )
-        return stream
-    except Exception as e:
-        logging.error("OpenAI API error: %s", str(e))
-        return "Error in grading (%s)" % str(e)
-
-def authenticate_user(username, password):
-    # Azure Cosmos DB configuration
-    key = os.environ['COSMOS_DB_KEY']  # Cosmos DB primary key
-    container_name = os.environ['COSMOS_DB_USER_CONTAINER']  # Container name
-
-    try:
-        # Create a Cosmos client
-        client = CosmosClient.from_connection_string(os.environ['COSMOS_DB_CONNECTION_STRING'])
-
-        # Select the database and container
-        database = client.get_database_client(database_name)
-        container = database.get_container_client(container_name)
-
-        # Hash the password
-        hashed_password = hashlib.sha256(password.encode()).hexdigest()
-
-        # Query to authenticate the user
-        query = "SELECT * FROM c WHERE c.userid=@username AND c.password=@password"
-        parameters = [
-            {"name": "@username", "value": username},
-            {"name": "@password", "value": hashed_password}
-        ]
-
-        items = list(container.query_items(
-            query=query,
-            parameters=parameters,
-            enable_cross_partition_query=True
-        ))
-
-        return len(items) > 0
-
-    except CosmosHttpResponseError as e:
-        logging.error("Cosmos DB error: %s", str(e))
-        return False
-
-
 st.set_page_config(page_title="Cengage Auto Grader", page_icon="cengage-favicon.png")
 
 st.title("Cengage Auto Grader")
@@ -282,14 +123,11 @@ if 'authenticated' not in st.session_state:
     st.session_state['authenticated'] = False
 if 'uploaded_files' not in st.session_state:
     st.session_state.uploaded_files = []
-if 'report_placeholders' not in st.session_state:
-    st.session_state['report_placeholders'] = {}
-if 'reports' not in st.session_state:
-    st.session_state['reports'] = {}
-if 'is_grading' not in st.session_state:
-    st.session_state['is_grading'] = False
+if 'jobs' not in st.session_state:
+    st.session_state['jobs'] = set()
 
 if st.button("Login", use_container_width=True):
+    from cosmos_store import authenticate_user
     st.session_state['authenticated'] = authenticate_user(user, password)
     if st.session_state['authenticated']:
         st.success("Logged in successfully")
@@ -298,6 +136,29 @@ if st.button("Login", use_container_width=True):
 
 
 if st.session_state['authenticated']:
+    from analysis_cache import get_analysis_cache
+    from cosmos_store import fetch_prompt, rubric_cache, warm_rubric_cache
+
+    # Bulk-load every rubric once per process so selecting exercises never waits on Cosmos DB
+    if os.environ.get('RUBRIC_CACHE_WARM', 'false').lower() == 'true' and not rubric_cache.warmed:
+        warm_rubric_cache(CHAPTER_DICT.keys())
+
+    analysis_cache_stats = get_analysis_cache().stats()
+    st.sidebar.caption(
+        f"Syntax analysis cache: {analysis_cache_stats['hits']} hits, {analysis_cache_stats['misses']} misses, "
+        f"{analysis_cache_stats['entries']} entries ({analysis_cache_stats['bytes'] / 1024:.0f} KiB)"
+    )
+
+    with st.sidebar.expander("Pipeline metrics"):
+        stage_summary = metrics.summary()
+        if stage_summary:
+            import pandas as pd
+            st.dataframe(pd.DataFrame(stage_summary).set_index('stage').round(3), use_container_width=True)
+        else:
+            st.caption("No submissions graded in this process yet")
+        st.json(metrics.counters())
+        st.download_button("Download metrics", metrics.prometheus_text(), file_name="grader_metrics.txt", key="metrics_download")
+
     try:
         book_titles = ['', 'Minnick Responsive Web Design with HTML 5 and CSS, 9e', 'Carey New Perspectives on HTML 5 and CSS: Comprehensive 8e', 'Carey New Perspectives on HTML5, CSS3, and JavaScript 6e']
     except Exception as e:
@@ -322,39 +183,38 @@ if st.session_state['authenticated']:
                 exercise = st.selectbox("Select Exercise", options=EXERCISE_DICT[st.session_state['selected_book']][st.session_state['selected_chapter']])
                 st.session_state['selected_exercise'] = exercise
 
-                def handle_grading(uploaded_file, prompt):
-                    """Perform grading and update the placeholder with the report and download button."""
-                    if uploaded_file.name not in st.session_state['report_placeholders']:
-                        st.session_state['report_placeholders'][uploaded_file.name] = st.empty()
-                    
-                    placeholder = st.session_state['report_placeholders'][uploaded_file.name]
-                    print(f"Grading {uploaded_file.name}...")
-                    grade_report = ""
-                    stream = grade_submission_stream(uploaded_file, prompt)
-                    for chunk in stream:
-                        if isinstance(stream, str) and "Error in grading" in stream:
-                            st.error(stream)
-                            break       
-                        elif "content" in chunk.choices[0].delta:
-                            grade_report += chunk.choices[0].delta.content
-                            # Update the placeholder with the latest part of the grading report
-                            with placeholder.container():
-                                st.markdown(f"### Suggested grading for {uploaded_file.name}\n{grade_report}{cursor_blink_str}", unsafe_allow_html=True)
-                    # Store the final report in session state
-                    st.session_state['reports'][uploaded_file.name] = grade_report
-
-                    # Update the placeholder with the final report and download button
+                def render_job(placeholder, file_name, job):
+                    """Render a grading job's report (partial while it is still running) into its placeholder."""
                     with placeholder.container():
-                        st.write(f"### Suggested grading for {uploaded_file.name}\n{grade_report}")
+                        if job['status'] == QUEUED:
+                            st.markdown(f"### Suggested grading for {file_name}\nWaiting for a grading worker...{cursor_blink_str}", unsafe_allow_html=True)
+                        elif job['status'] == RUNNING:
+                            st.markdown(f"### Suggested grading for {file_name}\n{job['report']}{cursor_blink_str}", unsafe_allow_html=True)
+                        elif job['status'] == FAILED:
+                            st.markdown(f"### Suggested grading for {file_name}")
+                            st.error(job['error'])
+                        else:
+                            st.markdown(f"### Suggested grading for {file_name}")
+                            st.write(job['report'])
+                            st.download_button(
+                                label=f"Download Report for {file_name}",
+                                data=job['report'],
+                                file_name=f"{file_name}_grading_report.txt",
+                                mime="text/plain",
+                                key=file_name+"_final"
+                            )
 
-                        
                 # Display prompt based on the selected exercise
                 if 'selected_exercise' in st.session_state and st.session_state['selected_exercise'] != '':
-                    promptResponse = fetch_prompt(st.session_state['selected_book'], st.session_state['selected_chapter'], st.session_state['selected_exercise'])
+                    rubric_key = (st.session_state['selected_book'], st.session_state['selected_chapter'], st.session_state['selected_exercise'])
+                    promptResponse = fetch_prompt(*rubric_key)
 
                     if promptResponse:
                         prompt = promptResponse["prompt"]
                         st.write("# Rubric: \n\n", prompt)
+                        if st.button("Reload rubric"):
+                            rubric_cache.invalidate(rubric_key)
+                            st.rerun()
 
                         uploaded_files = st.file_uploader("Upload your answer file", accept_multiple_files=True, type=["zip"], key="file_uploader")
 
@@ -363,37 +223,57 @@ if st.session_state['authenticated']:
                             st.session_state['uploaded_files'] = uploaded_files
 
                         result_container = st.container()
-
-                        # Button to trigger grading
-                        if st.button('Grade Submissions') or st.session_state['is_grading']:
-                            st.session_state['is_grading'] = True
-                            st.session_state['reports'] = {}
-                            result_container.empty()
+                        from fingerprint import cluster_submissions, format_clusters
+                        from grader import read_submission_text
+                        from job_queue import job_id, JOB_PROGRESS_INTERVAL, QUEUED, RUNNING, FAILED, FINISHED
+                        job_queue = get_grading_queue()
+
+                        # Jobs are keyed by submission content and rubric, so pressing the button again
+                        # or any rerun never repeats grading that is queued, running or done
+                        force_regrade = st.checkbox("Force regrade", help="Grade again instead of reusing stored reports for identical submissions")
+                        if st.button('Grade Submissions'):
                             for uploaded_file in st.session_state['uploaded_files']:
-                                    if st.session_state['report_placeholders'].get(uploaded_file.name) is not None:
-                                        st.session_state['report_placeholders'][uploaded_file.name].empty()
-                                    handle_grading(uploaded_file, prompt)
-                            st.session_state['is_grading'] = False
-
-                        #Clear the placeholders
-                        for file_name in st.session_state['uploaded_files']:
-                            if file_name.name in st.session_state['report_placeholders']:
-                                with st.session_state['report_placeholders'][file_name.name].container():
-                                    st.write("")
-
-                        
-                        # Reconstruct the view based on the persisted state
+                                print(f"Grading {uploaded_file.name}...")
+                                st.session_state['jobs'].add(job_queue.submit(uploaded_file.name, uploaded_file.getvalue(), prompt, force=force_regrade))
+
+                        # Show this session's jobs for the current uploads and rubric, polling until all are finished
+                        session_jobs = {}
                         for uploaded_file in st.session_state['uploaded_files']:
-                            file_name = uploaded_file.name
-                            if file_name in st.session_state['reports']:
-                                result_container.markdown(f"### Suggested grading for {file_name}")
-                                result_container.write(st.session_state['reports'][file_name])
-                                result_container.download_button(
-                                    label=f"Download Report for {file_name}",
-                                    data=st.session_state['reports'][file_name],
-                                    file_name=f"{file_name}_grading_report.txt",
-                                    mime="text/plain",
-                                    key=file_name+"_final"
-                                )
+                            uploaded_job_id = job_id(uploaded_file.getvalue(), prompt)
+                            if uploaded_job_id in st.session_state['jobs']:
+                                session_jobs[uploaded_file.name] = uploaded_job_id
+
+                        if session_jobs:
+                            placeholders = {file_name: result_container.empty() for file_name in session_jobs}
+                            rendered = {}
+                            while True:
+                                jobs = job_queue.get(session_jobs.values())
+                                for file_name, session_job_id in session_jobs.items():
+                                    job = jobs.get(session_job_id)
+                                    # Only redraw jobs that changed, so each finished report (and its download button) renders once
+                                    if job is not None and rendered.get(file_name) != (job['status'], len(job['report'])):
+                                        render_job(placeholders[file_name], file_name, job)
+                                        rendered[file_name] = (job['status'], len(job['report']))
+                                if all(job['status'] in FINISHED for job in jobs.values()):
+                                    break
+                                time.sleep(JOB_PROGRESS_INTERVAL)
+
+                            # Flag near-identical submissions (a plagiarism signal) once the batch is graded
+                            if len(session_jobs) > 1:
+                                submissions = {}
+                                for uploaded_file in st.session_state['uploaded_files']:
+                                    if uploaded_file.name in session_jobs:
+                                        try:
+                                            submissions[uploaded_file.name] = read_submission_text(io.BytesIO(uploaded_file.getvalue()))
+                                        except Exception as e:
+                                            logging.warning("Could not fingerprint %s: %s", uploaded_file.name, str(e))
+                                clusters = cluster_submissions(submissions)
+                                if clusters:
+                                    with result_container.expander(f"Similar submissions ({len(clusters)} clusters)"):
+                                        st.text(format_clusters(clusters))
                     else:
-                        st.error("Rubric not found for the selected exercise")
\ No newline at end of file
+                        st.error("Rubric not found for the selected exercise")
+                        # A missing rubric is cached too, so let users pick up one an admin has just added
+                        if st.button("Reload rubric"):
+                            rubric_cache.invalidate(rubric_key)
+                            st.rerun()
\ No newline at end of file
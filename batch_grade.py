@@ -0,0 +1,173 @@
+"""Grade a directory of submission ZIPs without the Streamlit UI.
+
+Example:
+    python batch_grade.py submissions/ --book "Minnick Responsive Web Design with HTML 5 and CSS, 9e" \\
+        --chapter 1 --exercise ex01 --output-dir reports/
+
+Each submission's report is written to <output-dir>/<zip name>_grading_report.txt and a
+summary.csv lists every submission. Reports already in the output directory are skipped,
+so an interrupted run can simply be restarted.
+
+With --pack, several small submissions are graded in one request (see packed_grading.py)
+and packs.csv records the prompt tokens and time each pack saved.
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+
+from fingerprint import cluster_submissions, format_clusters
+from grader import read_submission_text
+from grading import grade_submission
+from grading_engine import MAX_WORKERS
+from packed_grading import grade_packed
+
+SUMMARY_FILE = 'summary.csv'
+PACKS_FILE = 'packs.csv'
+SUMMARY_COLUMNS = ['submission', 'status', 'seconds', 'prompt_tokens', 'pack', 'cluster', 'report', 'error']
+
+
+def report_path(output_dir, zip_name):
+    # Same file name the app's download button uses
+    return os.path.join(output_dir, f"{zip_name}_grading_report.txt")
+
+
+def write_report(path, report):
+    """Write a report atomically so a crash never leaves a partial report that a rerun would skip."""
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        file.write(report)
+    os.replace(temp_path, path)
+
+
+def report_row(zip_name, report, output_dir, seconds, prompt_tokens, pack=''):
+    row = {'submission': zip_name, 'seconds': round(seconds, 2), 'prompt_tokens': prompt_tokens, 'pack': pack}
+    if report.startswith("Error in grading"):
+        return dict(row, status='failed', report='', error=report)
+    path = report_path(output_dir, zip_name)
+    write_report(path, report)
+    return dict(row, status='graded', report=path, error='')
+
+
+def grade_one(zip_path, prompt, output_dir, force=False):
+    start = time.monotonic()
+    stats = {}
+    report = grade_submission(zip_path, prompt, stats, force=force)
+    return report_row(os.path.basename(zip_path), report, output_dir, time.monotonic() - start, stats.get('tokens', 0))
+
+
+def grade_in_packs(zip_paths, prompt, output_dir, workers, force=False):
+    """Grade zip_paths several per request; return the summary rows and write packs.csv."""
+    start = time.monotonic()
+    results, packs = grade_packed({os.path.basename(zip_path): zip_path for zip_path in zip_paths}, prompt, force, workers)
+    # Submissions in one pack share its request, so each row's time is its pack's share
+    pack_seconds = {stats['pack']: stats['seconds'] / stats['submissions'] for stats in packs}
+    rows = [
+        report_row(zip_name, result['report'], output_dir, pack_seconds.get(result['pack'], 0.0), result['prompt_tokens'], result['pack'])
+        for zip_name, result in results.items()
+    ]
+
+    packs = pd.DataFrame(packs, columns=['pack', 'submissions', 'single_tokens', 'packed_tokens', 'tokens_saved',
+                                         'requests_saved', 'fallbacks', 'seconds', 'estimated_seconds_saved'])
+    packs.to_csv(os.path.join(output_dir, PACKS_FILE), index=False)
+    logging.info("Graded %d submissions in %d packs in %.1fs: %d prompt tokens and %d requests saved",
+                 len(zip_paths), len(packs), time.monotonic() - start, packs['tokens_saved'].sum(), packs['requests_saved'].sum())
+    return rows
+
+
+def load_rubric(args):
+    if args.rubric_file:
+        with open(args.rubric_file, 'r', encoding='utf-8') as file:
+            return file.read()
+    from cosmos_store import fetch_prompt
+    rubric = fetch_prompt(args.book, args.chapter, args.exercise)
+    return rubric["prompt"] if rubric else None
+
+
+def find_clusters(zip_paths):
+    """Cluster near-identical submissions and return {zip name: cluster number}."""
+    submissions = {}
+    for zip_path in zip_paths:
+        try:
+            submissions[os.path.basename(zip_path)] = read_submission_text(zip_path)
+        except Exception as e:
+            logging.warning("Could not fingerprint %s: %s", zip_path, str(e))
+    clusters = cluster_submissions(submissions)
+    if clusters:
+        logging.info("Near-duplicate submissions:\n%s", format_clusters(clusters))
+    return {name: number for number, cluster in enumerate(clusters, start=1) for name in cluster['members']}
+
+
+def run_batch(submissions_dir, prompt, output_dir, workers=MAX_WORKERS, force=False, pack=False):
+    """Grade every ZIP in submissions_dir that has no report yet (every ZIP when force is set) and return the summary DataFrame.
+
+    With pack set, submissions are graded several per request.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    zip_paths = sorted(
+        os.path.join(submissions_dir, name) for name in os.listdir(submissions_dir) if name.lower().endswith('.zip')
+    )
+
+    rows = []
+    pending = []
+    for zip_path in zip_paths:
+        path = report_path(output_dir, os.path.basename(zip_path))
+        if os.path.exists(path) and not force:
+            rows.append({'submission': os.path.basename(zip_path), 'status': 'skipped', 'seconds': 0.0, 'prompt_tokens': 0, 'pack': '', 'report': path, 'error': ''})
+        else:
+            pending.append(zip_path)
+    logging.info("%d submissions, %d already graded, %d to grade", len(zip_paths), len(zip_paths) - len(pending), len(pending))
+
+    if pack:
+        rows.extend(grade_in_packs(pending, prompt, output_dir, workers, force))
+    else:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = {executor.submit(grade_one, zip_path, prompt, output_dir, force): zip_path for zip_path in pending}
+            for done, future in enumerate(as_completed(futures), start=1):
+                row = future.result()
+                rows.append(row)
+                logging.info("[%d/%d] %s %s in %.1fs", done, len(pending), row['submission'], row['status'], row['seconds'])
+
+    clusters = find_clusters(zip_paths)
+    for row in rows:
+        row['cluster'] = clusters.get(row['submission'], '')
+
+    summary = pd.DataFrame(rows, columns=SUMMARY_COLUMNS)
+    summary = summary.sort_values('submission').reset_index(drop=True)
+    summary.to_csv(os.path.join(output_dir, SUMMARY_FILE), index=False)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Grade a directory of submission ZIPs against one rubric.")
+    parser.add_argument('submissions_dir', help="directory containing one ZIP per student")
+    parser.add_argument('--book', help="book title, as stored with the rubric in Cosmos DB")
+    parser.add_argument('--chapter', help="chapter, e.g. 1")
+    parser.add_argument('--exercise', help="exercise, e.g. ex01")
+    parser.add_argument('--rubric-file', help="read the rubric from this file instead of Cosmos DB")
+    parser.add_argument('--output-dir', default='reports', help="where reports and summary.csv are written (default: reports)")
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS, help=f"submissions graded in parallel (default: {MAX_WORKERS})")
+    parser.add_argument('--force', action='store_true', help="regrade everything, ignoring existing reports and the result cache")
+    parser.add_argument('--pack', action='store_true', help="grade several small submissions per request to save prompt tokens")
+    args = parser.parse_args(argv)
+
+    if not args.rubric_file and not (args.book and args.chapter and args.exercise):
+        parser.error("either --rubric-file or all of --book, --chapter and --exercise are required")
+
+    logging.basicConfig(level=logging.INFO)
+    prompt = load_rubric(args)
+    if not prompt:
+        logging.error("Rubric not found for the selected exercise")
+        return 1
+
+    summary = run_batch(args.submissions_dir, prompt, args.output_dir, args.workers, args.force, args.pack)
+    print(summary['status'].value_counts().to_string())
+    return 1 if (summary['status'] == 'failed').any() else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1 @@
+"""Offline benchmarks for the grading pipeline; see run_benchmarks.py."""
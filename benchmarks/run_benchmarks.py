@@ -0,0 +1,279 @@
+"""Measure grading throughput offline, against local stand-ins for Azure OpenAI, Cosmos DB and the Nu validator.
+
+Run from the repository root:
+
+    python -m benchmarks.run_benchmarks --submissions 40 --workers 4 --output bench.json
+    python -m benchmarks.run_benchmarks --baseline bench.json   # exit 1 on a regression
+
+These stages are measured on the same synthetic corpus, each starting from empty caches:
+syntax_check alone, grade_submission_stream (syntax check plus streamed completion), its async
+counterpart used by the job queue, and full batch_grade runs with and without --pack. Every
+stage reports submissions per minute and latency percentiles; the streaming stages also report
+time to first token.
+Memory per submission is the tracemalloc peak of grading a few submissions one at a time.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.stub_servers import StubOpenAIServer, StubRubricContainer, StubValidatorServer, install_stub_rubrics
+from benchmarks.synthetic_zips import PROFILES, write_corpus
+
+BOOK = "Minnick Responsive Web Design with HTML 5 and CSS, 9e"
+RUBRIC = {'title': BOOK, 'chapter': '1', 'ex': 'ex01', 'prompt': (
+    "1. The page has a valid HTML5 structure (10 points)\n"
+    "2. The style sheet is linked and styles the sections (20 points)\n"
+    "3. The page validates without errors (10 points)\n"
+)}
+# (metric, True when higher is better) compared against --baseline
+REGRESSION_METRICS = (('submissions_per_minute', True), ('p95_seconds', False), ('ttft_p95_seconds', False))
+
+
+def configure_environment(args, openai_stub, validator_stub, cache_dir):
+    """Point the grader at the stubs; must run before any grader module is imported."""
+    endpoints = [openai_stub.endpoint_config(name=f"stub{index}") for index in range(args.endpoints)]
+    os.environ.update({
+        'AZURE_OPENAI_ENDPOINTS': json.dumps(endpoints),
+        'HTML_VALIDATOR_URL': validator_stub.validator_url,
+        'HTML_VALIDATOR_BACKEND': 'nu',
+        'GRADER_CACHE_DIR': cache_dir,
+        'COSMOS_DB_PROMPT_CONTAINER': 'prompts',
+    })
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def clear_caches():
+    from analysis_cache import get_analysis_cache, get_result_cache
+    get_analysis_cache().clear()
+    get_result_cache().clear()
+
+
+def summarise(stage, seconds, elapsed, failures, **extra):
+    return dict({
+        'stage': stage,
+        'submissions': len(seconds),
+        'failures': failures,
+        'elapsed_seconds': round(elapsed, 3),
+        'submissions_per_minute': round(len(seconds) / elapsed * 60, 1) if elapsed else None,
+        'p50_seconds': percentile(seconds, 0.5),
+        'p95_seconds': percentile(seconds, 0.95),
+    }, **extra)
+
+
+def bench_syntax_check(paths, workers):
+    from grader import syntax_check
+    from openai_pool import get_pool
+
+    def run(path):
+        start = time.perf_counter()
+        syntax_check(path, get_pool().model)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        seconds = list(executor.map(run, paths))
+    return summarise('syntax_check', seconds, time.perf_counter() - start, 0)
+
+
+def grade_streaming(path, prompt):
+    """Grade one submission through grade_submission_stream; return (seconds, time to first token, failed)."""
+    from grading import grade_submission_stream
+
+    start = time.perf_counter()
+    first_token = None
+    deltas = grade_submission_stream(path, prompt, force=True)
+    if isinstance(deltas, str):
+        return time.perf_counter() - start, None, True
+    for _ in deltas:
+        if first_token is None:
+            first_token = time.perf_counter() - start
+    return time.perf_counter() - start, first_token, False
+
+
+def bench_grade_stream(paths, prompt, workers):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(lambda path: grade_streaming(path, prompt), paths))
+    elapsed = time.perf_counter() - start
+    first_tokens = [first_token for _, first_token, failed in results if not failed]
+    return summarise(
+        'grade_submission_stream', [seconds for seconds, _, _ in results], elapsed,
+        sum(failed for _, _, failed in results),
+        ttft_p50_seconds=percentile(first_tokens, 0.5), ttft_p95_seconds=percentile(first_tokens, 0.95),
+    )
+
+
+async def grade_async(path, prompt):
+    from grading import grade_submission_astream
+
+    start = time.perf_counter()
+    first_token = None
+    deltas = await grade_submission_astream(path, prompt, force=True)
+    if isinstance(deltas, str):
+        return time.perf_counter() - start, None, True
+    async for _ in deltas:
+        if first_token is None:
+            first_token = time.perf_counter() - start
+    return time.perf_counter() - start, first_token, False
+
+
+def bench_grade_astream(paths, prompt, workers):
+    """The job queue's path: up to workers gradings at a time, all streaming on one event loop."""
+    async def run_all():
+        slots = asyncio.Semaphore(workers)
+
+        async def run(path):
+            async with slots:
+                return await grade_async(path, prompt)
+        return await asyncio.gather(*(run(path) for path in paths))
+
+    start = time.perf_counter()
+    results = asyncio.run(run_all())
+    elapsed = time.perf_counter() - start
+    first_tokens = [first_token for _, first_token, failed in results if not failed]
+    return summarise(
+        'grade_submission_astream', [seconds for seconds, _, _ in results], elapsed,
+        sum(failed for _, _, failed in results),
+        ttft_p50_seconds=percentile(first_tokens, 0.5), ttft_p95_seconds=percentile(first_tokens, 0.95),
+    )
+
+
+def bench_batch(submissions_dir, workers, pack=False):
+    from batch_grade import run_batch
+    from cosmos_store import fetch_prompt
+
+    output_dir = tempfile.mkdtemp(prefix='bench-reports-')
+    start = time.perf_counter()
+    rubric = fetch_prompt(RUBRIC['title'], RUBRIC['chapter'], RUBRIC['ex'])
+    summary = run_batch(submissions_dir, rubric['prompt'], output_dir, workers, force=True, pack=pack)
+    elapsed = time.perf_counter() - start
+    return summarise('batch_packed' if pack else 'batch', list(summary['seconds']), elapsed, int((summary['status'] == 'failed').sum()),
+                     near_duplicate_submissions=int((summary['cluster'] != '').sum()))
+
+
+def measure_memory(paths, prompt):
+    """tracemalloc peak (KiB) while grading each submission alone; tracing is too slow to leave on for the timed stages."""
+    peaks = []
+    tracemalloc.start()
+    try:
+        for path in paths:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            grade_streaming(path, prompt)
+            peaks.append((tracemalloc.get_traced_memory()[1] - baseline) / 1024)
+    finally:
+        tracemalloc.stop()
+    return {'stage': 'memory', 'submissions': len(peaks), 'peak_kib_p50': round(percentile(peaks, 0.5), 1),
+            'peak_kib_max': round(max(peaks), 1), 'max_rss_mib': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+
+
+def find_regressions(results, baseline, tolerance):
+    """Compare each stage's headline metrics with a previous run's; tolerance is a fraction, e.g. 0.2."""
+    previous = {result['stage']: result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        for metric, higher_is_better in REGRESSION_METRICS:
+            before, after = previous.get(result['stage'], {}).get(metric), result.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(f"{result['stage']} {metric}: {before:g} -> {after:g} ({change:+.0%})")
+    return regressions
+
+
+def print_results(results):
+    for result in results:
+        values = ', '.join(f"{key}={value:.3f}" if isinstance(value, float) else f"{key}={value}"
+                           for key, value in result.items() if key != 'stage' and value is not None)
+        print(f"{result['stage']:<24} {values}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the grading pipeline against local stub services.")
+    parser.add_argument('--submissions', type=int, default=20, help="synthetic submissions to grade (default: 20)")
+    parser.add_argument('--profile', choices=sorted(PROFILES) + ['mixed'], default='mixed')
+    parser.add_argument('--workers', type=int, default=4, help="submissions graded concurrently (default: 4)")
+    parser.add_argument('--endpoints', type=int, default=2, help="stub Azure OpenAI endpoints in the pool (default: 2)")
+    parser.add_argument('--openai-latency', type=float, default=0.5, help="seconds before the first token (default: 0.5)")
+    parser.add_argument('--chunks', type=int, default=50, help="chunks per streamed report (default: 50)")
+    parser.add_argument('--chunk-interval', type=float, default=0.02, help="seconds between streamed chunks (default: 0.02)")
+    parser.add_argument('--rate-limit-every', type=int, default=0, help="answer every Nth OpenAI request with 429")
+    parser.add_argument('--rate-limit-probability', type=float, default=0.0, help="answer this fraction of OpenAI requests with 429")
+    parser.add_argument('--validator-latency', type=float, default=0.3, help="seconds per Nu validator request (default: 0.3)")
+    parser.add_argument('--cosmos-latency', type=float, default=0.1, help="seconds per Cosmos DB query (default: 0.1)")
+    parser.add_argument('--memory-sample', type=int, default=3, help="submissions graded alone to measure memory (default: 3)")
+    parser.add_argument('--stages', default='syntax_check,grade_submission_stream,grade_submission_astream,batch,batch_packed,memory')
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--baseline', help="compare with the results JSON of an earlier run and exit 1 on a regression")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed relative change before a regression (default: 0.2)")
+    args = parser.parse_args(argv)
+    stages = set(args.stages.split(','))
+
+    logging.basicConfig(level=logging.WARNING)
+    workdir = tempfile.mkdtemp(prefix='grader-bench-')
+    submissions_dir = os.path.join(workdir, 'submissions')
+    paths = write_corpus(submissions_dir, args.submissions, args.profile)
+
+    openai_stub = StubOpenAIServer(args.openai_latency, args.chunks, args.chunk_interval,
+                                   args.rate_limit_every, args.rate_limit_probability)
+    validator_stub = StubValidatorServer(args.validator_latency)
+    with openai_stub, validator_stub:
+        configure_environment(args, openai_stub, validator_stub, os.path.join(workdir, 'cache'))
+        install_stub_rubrics(StubRubricContainer([RUBRIC], args.cosmos_latency))
+        import metrics
+
+        results = []
+        if 'syntax_check' in stages:
+            clear_caches()
+            results.append(bench_syntax_check(paths, args.workers))
+        if 'grade_submission_stream' in stages:
+            clear_caches()
+            results.append(bench_grade_stream(paths, RUBRIC['prompt'], args.workers))
+        if 'grade_submission_astream' in stages:
+            clear_caches()
+            results.append(bench_grade_astream(paths, RUBRIC['prompt'], args.workers))
+        if 'batch' in stages:
+            clear_caches()
+            results.append(bench_batch(submissions_dir, args.workers))
+        if 'batch_packed' in stages:
+            clear_caches()
+            results.append(bench_batch(submissions_dir, args.workers, pack=True))
+        if 'memory' in stages:
+            clear_caches()
+            results.append(measure_memory(paths[:args.memory_sample], RUBRIC['prompt']))
+
+    print_results(results)
+    print(f"\nStub OpenAI: {openai_stub.requests} requests, {openai_stub.throttled} throttled; "
+          f"validator: {validator_stub.requests} requests")
+    print(metrics.prometheus_text())
+
+    report = {'arguments': vars(args), 'results': results}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as file:
+            regressions = find_regressions(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
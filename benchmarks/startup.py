@@ -0,0 +1,74 @@
+"""Measure how quickly a fresh process renders the login page, and check it loads none of the grading stack.
+
+    python -m benchmarks.startup --runs 3 --target 1.5
+
+Each run starts a new interpreter, imports Streamlit and renders app.py once with Streamlit's
+AppTest, as a new App Service instance does for its first visitor. Exits 1 when the median
+first render exceeds --target seconds or when the login page imported a grading module.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app.py')
+# Modules that must only load once a user has logged in and starts grading
+GRADING_MODULES = ('azure.cosmos', 'openai', 'aiohttp', 'cssutils', 'requests', 'cosmos_store', 'openai_pool',
+                   'grader', 'grading', 'job_queue', 'html_validator', 'css_validator', 'eslint_runner')
+
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+imported = time.perf_counter()
+app = AppTest.from_file(sys.argv[1], default_timeout=60).run()
+rendered = time.perf_counter()
+app.run()
+print(json.dumps({
+    'streamlit_import_seconds': imported - start,
+    'first_render_seconds': rendered - imported,
+    'rerun_seconds': time.perf_counter() - rendered,
+    'login_rendered': len(app.text_input) == 2 and any(button.label == 'Login' for button in app.button),
+    'exceptions': [str(exception.value) for exception in app.exception],
+    'grading_modules': sorted(name for name in json.loads(sys.argv[2]) if name in sys.modules),
+}))
+"""
+
+
+def measure(runs):
+    results = []
+    for _ in range(runs):
+        completed = subprocess.run([sys.executable, '-c', CHILD, APP, json.dumps(GRADING_MODULES)],
+                                   capture_output=True, text=True, cwd=os.path.dirname(APP), check=True)
+        results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure login page cold-start time.")
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--target', type=float, default=1.5, help="median first render budget in seconds (default: 1.5)")
+    args = parser.parse_args(argv)
+
+    results = measure(args.runs)
+    for key in ('streamlit_import_seconds', 'first_render_seconds', 'rerun_seconds'):
+        print(f"{key:<26} median {statistics.median(result[key] for result in results):.3f}s")
+
+    failures = []
+    first_render = statistics.median(result['first_render_seconds'] for result in results)
+    if first_render > args.target:
+        failures.append(f"first render took {first_render:.3f}s (target {args.target:g}s)")
+    for result in results:
+        if not result['login_rendered'] or result['exceptions']:
+            failures.append(f"login page did not render: {result['exceptions']}")
+        if result['grading_modules']:
+            failures.append(f"login page imported {', '.join(result['grading_modules'])}")
+    for failure in sorted(set(failures)):
+        print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,224 @@
+"""Local stand-ins for Azure OpenAI, the Nu HTML validator and the Cosmos DB rubric container.
+
+Each server listens on 127.0.0.1 on a free port and can be used as a context manager:
+
+    with StubOpenAIServer(latency=0.2, chunks=40, chunk_interval=0.02) as openai_stub:
+        os.environ['AZURE_OPENAI_ENDPOINTS'] = json.dumps([openai_stub.endpoint_config()])
+"""
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPORT_TEXT = (
+    "Grading report\n\n"
+    "1. Document structure: the page uses a doctype, head and body correctly. 10/10\n"
+    "2. Styling: the style sheet is linked and the selectors match the rubric. 18/20\n"
+    "3. Validation: fix the unclosed element reported by the validator. 7/10\n"
+    "Total: 35/40\n"
+)
+
+
+class _StubServer:
+    """A threaded HTTP server whose handler delegates to the owning stub."""
+
+    def __init__(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                stub.handle(self, self.rfile.read(length))
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = None
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+            return self.requests
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True, name=type(self).__name__)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def handle(self, handler, body):
+        raise NotImplementedError
+
+    @staticmethod
+    def send_json(handler, status, payload, headers=None):
+        data = json.dumps(payload).encode('utf-8')
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(data)
+
+
+class StubOpenAIServer(_StubServer):
+    """Answer Azure OpenAI ChatCompletion requests with a canned report.
+
+    latency is the delay before the first byte (time to first token when streaming), chunks and
+    chunk_interval control how the report is streamed, and every rate_limit_every-th request
+    (or a rate_limit_probability fraction of requests) is answered with 429 and Retry-After.
+    Packed requests (see packed_grading.py) get one report per submission in the requested JSON.
+    """
+
+    PATH = re.compile(r'^/openai/deployments/(?P<deployment>[^/]+)/chat/completions')
+    PACKED_SUBMISSION = re.compile(r'^=== Submission (\S+) ===$', re.MULTILINE)
+
+    def __init__(self, latency=0.5, chunks=50, chunk_interval=0.02, rate_limit_every=0, rate_limit_probability=0.0,
+                 retry_after=1, report=REPORT_TEXT, seed=0):
+        super().__init__()
+        self.latency = latency
+        self.chunks = max(1, chunks)
+        self.chunk_interval = chunk_interval
+        self.rate_limit_every = rate_limit_every
+        self.rate_limit_probability = rate_limit_probability
+        self.retry_after = retry_after
+        self.report = report
+        self.throttled = 0
+        self._random = random.Random(seed)
+
+    def endpoint_config(self, name='stub', model='stub-model', **options):
+        """An entry for AZURE_OPENAI_ENDPOINTS pointing at this server."""
+        return dict(options, name=name, endpoint=self.url, api_key='stub-key', model=model)
+
+    def _should_throttle(self, number):
+        if self.rate_limit_every and number % self.rate_limit_every == 0:
+            return True
+        with self._lock:
+            return self.rate_limit_probability > 0 and self._random.random() < self.rate_limit_probability
+
+    def handle(self, handler, body):
+        match = self.PATH.match(handler.path)
+        if not match:
+            self.send_json(handler, 404, {'error': {'code': '404', 'message': 'Resource not found'}})
+            return
+        number = self.count_request()
+        if self._should_throttle(number):
+            with self._lock:
+                self.throttled += 1
+            self.send_json(handler, 429, {'error': {'code': '429', 'message': 'Rate limit is exceeded (stub).'}},
+                           {'Retry-After': str(self.retry_after)})
+            return
+
+        request = json.loads(body or b'{}')
+        prompt_tokens = sum(len(message.get('content', '')) for message in request.get('messages', [])) // 4 + 1
+        packed_ids = [submission_id for message in request.get('messages', [])
+                      for submission_id in self.PACKED_SUBMISSION.findall(message.get('content', ''))]
+        content = json.dumps({'reports': [{'id': submission_id, 'report': self.report} for submission_id in packed_ids]}) if packed_ids else self.report
+        # Generating several reports takes proportionally longer
+        time.sleep(self.latency * max(1, len(packed_ids)))
+        if request.get('stream'):
+            self._stream(handler, match.group('deployment'))
+        else:
+            self.send_json(handler, 200, {
+                'id': f"chatcmpl-stub-{number}",
+                'object': 'chat.completion',
+                'model': match.group('deployment'),
+                'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': content}}],
+                'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': len(content) // 4,
+                          'total_tokens': prompt_tokens + len(content) // 4},
+            })
+
+    def _stream(self, handler, deployment):
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'text/event-stream')
+        handler.send_header('Connection', 'close')
+        handler.end_headers()
+        handler.close_connection = True
+
+        size = -(-len(self.report) // self.chunks)
+        pieces = [{'role': 'assistant'}] + [{'content': self.report[i:i + size]} for i in range(0, len(self.report), size)]
+        for index, delta in enumerate(pieces):
+            if index > 1:
+                time.sleep(self.chunk_interval)
+            chunk = {'id': 'chatcmpl-stub', 'object': 'chat.completion.chunk', 'model': deployment,
+                     'choices': [{'index': 0, 'finish_reason': None, 'delta': delta}]}
+            handler.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            handler.wfile.flush()
+        handler.wfile.write(b"data: [DONE]\n\n")
+        handler.wfile.flush()
+
+
+class StubValidatorServer(_StubServer):
+    """Answer Nu validator POSTs (?out=json) with one warning and, for every error_every-th document, one error."""
+
+    def __init__(self, latency=0.3, error_every=3, rate_limit_every=0):
+        super().__init__()
+        self.latency = latency
+        self.error_every = error_every
+        self.rate_limit_every = rate_limit_every
+
+    @property
+    def validator_url(self):
+        return f"{self.url}/nu/?out=json"
+
+    def handle(self, handler, body):
+        number = self.count_request()
+        time.sleep(self.latency)
+        if self.rate_limit_every and number % self.rate_limit_every == 0:
+            self.send_json(handler, 429, {'messages': []}, {'Retry-After': '0'})
+            return
+        messages = [{'type': 'info', 'subType': 'warning', 'lastLine': 1,
+                     'message': 'Consider adding a “lang” attribute to the “html” start tag.'}]
+        if self.error_every and number % self.error_every == 0:
+            line = body.count(b'\n') // 2 + 1
+            messages.append({'type': 'error', 'lastLine': line, 'message': 'End tag “div” seen, but there were open elements.'})
+        self.send_json(handler, 200, {'url': '', 'messages': messages})
+
+
+class StubRubricContainer:
+    """In-process stand-in for the Cosmos DB rubric container; query_items waits latency seconds per query."""
+
+    def __init__(self, rubrics, latency=0.1):
+        self.rubrics = list(rubrics)
+        self.latency = latency
+        self.queries = 0
+
+    def query_items(self, query, parameters, enable_cross_partition_query=False):
+        self.queries += 1
+        time.sleep(self.latency)
+        values = {parameter['name']: parameter['value'] for parameter in parameters}
+        if '@titles' in values:
+            return [rubric for rubric in self.rubrics if rubric['title'] in values['@titles']]
+        return [
+            rubric for rubric in self.rubrics
+            if (rubric['title'], rubric['chapter'], rubric['ex']) == (values['@book_title'], values['@chapter'], values['@exercise'])
+        ]
+
+
+def install_stub_rubrics(container):
+    """Route cosmos_store's rubric queries to container and drop any rubrics already cached."""
+    import cosmos_store
+    cosmos_store._containers[('COSMOS_DB_PROMPT_CONTAINER', False)] = container
+    cosmos_store.rubric_cache.invalidate()
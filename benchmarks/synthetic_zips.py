@@ -0,0 +1,152 @@
+"""Generate synthetic submission ZIPs shaped like the exercises students hand in.
+
+    python -m benchmarks.synthetic_zips /tmp/submissions --count 50 --profile mixed
+"""
+import argparse
+import io
+import os
+import random
+import zipfile
+
+# (html files, css files, js files, paragraphs per page, rules per style sheet, functions per script, vendored library)
+PROFILES = {
+    'small': (1, 1, 0, 5, 10, 0, False),
+    'medium': (3, 2, 1, 20, 40, 8, False),
+    'large': (8, 4, 3, 60, 120, 25, True),
+}
+MIXED = ('small', 'small', 'medium', 'medium', 'medium', 'large')
+
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore et dolore '
+         'magna aliqua responsive layout grid flex header footer navigation gallery contact').split()
+PROPERTIES = ('color: #{:06x}', 'margin: {}px', 'padding: {}px {}px', 'font-size: {}em', 'display: flex', 'width: {}%')
+
+
+def _sentence(rng, length=12):
+    return ' '.join(rng.choice(WORDS) for _ in range(length)).capitalize() + '.'
+
+
+def html_page(rng, title, paragraphs, stylesheets, scripts, broken=False):
+    lines = ['<!DOCTYPE html>', '<html lang="en">', '<head>', '   <!--', f'   Author: Student {rng.randint(1, 999)}',
+             f'   Date: 2024-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}', '   -->', '   <meta charset="utf-8">',
+             f'   <title>{title}</title>']
+    lines += [f'   <link href="{name}" rel="stylesheet">' for name in stylesheets]
+    lines += [f'   <script src="{name}" defer></script>' for name in scripts]
+    lines += ['</head>', '<body>', '   <header><h1>' + title + '</h1></header>', '   <main>']
+    for number in range(paragraphs):
+        lines.append(f'      <section id="section{number}">')
+        lines.append(f'         <h2>{_sentence(rng, 3)}</h2>')
+        lines.append(f'         <p>{_sentence(rng)} <a href="#section{(number + 1) % paragraphs}">Next</a></p>')
+        if broken and number == paragraphs // 2:
+            lines.append('         <div><p>Unclosed element')
+        lines.append('      </section>')
+    lines += ['   </main>', '   <footer>' + _sentence(rng, 4) + '</footer>', '</body>', '</html>']
+    return '\n'.join(lines) + '\n'
+
+
+def style_sheet(rng, rules, broken=False):
+    lines = ['@charset "utf-8";', '/* ' + _sentence(rng, 6) + ' */']
+    for number in range(rules):
+        lines.append(f'section#section{number} {rng.choice(("h2", "p", "a"))} {{')
+        for template in rng.sample(PROPERTIES, 3):
+            values = [rng.randint(0, 0xffffff) if 'color' in template else rng.randint(1, 40) for _ in range(template.count('{}') or 1)]
+            lines.append('   ' + template.format(*values) + ';')
+        if broken and number == rules // 2:
+            lines.append('   colr red')
+        lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+
+def script(rng, functions, broken=False):
+    lines = ['"use strict";', '// ' + _sentence(rng, 6)]
+    for number in range(functions):
+        lines += [f'function update{number}(items) {{', '   let total = 0;', '   for (let i = 0; i < items.length; i++) {',
+                  f'      total += items[i] * {rng.randint(1, 9)};', '   }',
+                  f'   document.getElementById("section{number}").textContent = total;', '   return total;', '}']
+    if broken:
+        lines.append('function broken( {')
+    lines.append('window.addEventListener("load", () => update0([1, 2, 3]));' if functions else '')
+    return '\n'.join(lines) + '\n'
+
+
+def vendored_library(rng):
+    """A large minified-looking file, like the jQuery copies students bundle."""
+    body = ';'.join(f'function _{i}(a,b){{return a+b*{i}}}' for i in range(4000))
+    return '/*! jQuery v3.7.1 | (c) OpenJS Foundation and other contributors | jquery.org/license */\n' + body + '\n'
+
+
+def submission_files(seed, profile='medium'):
+    """Return {path in ZIP: bytes} for one deterministic synthetic submission."""
+    rng = random.Random(seed)
+    html_count, css_count, js_count, paragraphs, rules, functions, vendored = PROFILES[profile]
+    broken = rng.random() < 0.5
+    folder = f"student{seed:04d}/"
+    stylesheets = [f"styles{i}.css" for i in range(css_count)]
+    scripts = [f"script{i}.js" for i in range(js_count)] + (['jquery.min.js'] if vendored else [])
+
+    files = {}
+    for i in range(html_count):
+        name = 'index.html' if i == 0 else f"page{i}.html"
+        files[folder + name] = html_page(rng, _sentence(rng, 3), paragraphs, stylesheets, scripts, broken and i == 0).encode('utf-8')
+    for i, name in enumerate(stylesheets):
+        files[folder + name] = style_sheet(rng, rules, broken and i == 0).encode('utf-8')
+    for i in range(js_count):
+        files[folder + f"script{i}.js"] = script(rng, functions, broken and i == 0).encode('utf-8')
+    if vendored:
+        files[folder + 'jquery.min.js'] = vendored_library(rng).encode('utf-8')
+    # Binary assets are skipped by process_zip but still cost decompression-limit bookkeeping
+    files[folder + 'images/logo.png'] = bytes(rng.getrandbits(8) for _ in range(2048))
+    return files
+
+
+def make_zip(files):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for name, data in files.items():
+            zip_file.writestr(name, data)
+    return buffer.getvalue()
+
+
+def generate(count, profile='mixed', duplicate_fraction=0.1, seed=0):
+    """Yield (name, zip bytes) for count submissions; about duplicate_fraction of them copy an earlier one."""
+    rng = random.Random(seed)
+    generated = []
+    for number in range(count):
+        if generated and rng.random() < duplicate_fraction:
+            # A copied submission: same code, a different author comment
+            source_seed, source_profile = rng.choice(generated)
+            files = submission_files(source_seed, source_profile)
+            files = {name: data.replace(b'Author: Student', b'Author: Copied') for name, data in files.items()}
+        else:
+            source_profile = rng.choice(MIXED) if profile == 'mixed' else profile
+            source_seed = seed * 100000 + number
+            generated.append((source_seed, source_profile))
+            files = submission_files(source_seed, source_profile)
+        yield f"submission{number:04d}.zip", make_zip(files)
+
+
+def write_corpus(directory, count, profile='mixed', duplicate_fraction=0.1, seed=0):
+    """Write the generated ZIPs into directory and return their paths."""
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for name, data in generate(count, profile, duplicate_fraction, seed):
+        path = os.path.join(directory, name)
+        with open(path, 'wb') as file:
+            file.write(data)
+        paths.append(path)
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write synthetic submission ZIPs for benchmarking.")
+    parser.add_argument('directory')
+    parser.add_argument('--count', type=int, default=20)
+    parser.add_argument('--profile', choices=sorted(PROFILES) + ['mixed'], default='mixed')
+    parser.add_argument('--duplicates', type=float, default=0.1, help="fraction of submissions copied from another (default: 0.1)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    paths = write_corpus(args.directory, args.count, args.profile, args.duplicates, args.seed)
+    print(f"Wrote {len(paths)} submissions to {args.directory}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from azure.cosmos import CosmosClient
+from azure.cosmos.exceptions import CosmosHttpResponseError
+
+import metrics
+
+RUBRIC_CACHE_TTL = float(os.environ.get('RUBRIC_CACHE_TTL', '900'))
+
+_clients = {}
+_containers = {}
+_clients_lock = threading.Lock()
+
+
+def get_cosmos_client(use_connection_string=False):
+    """Return the process-wide Cosmos client; the SDK pools connections inside each client."""
+    with _clients_lock:
+        if use_connection_string not in _clients:
+            if use_connection_string:
+                _clients[use_connection_string] = CosmosClient.from_connection_string(os.environ['COSMOS_DB_CONNECTION_STRING'])
+            else:
+                _clients[use_connection_string] = CosmosClient(os.environ['COSMOS_DB_URL'], credential=os.environ['COSMOS_DB_KEY'])
+        return _clients[use_connection_string]
+
+
+def get_container(container_env_var, use_connection_string=False):
+    """Return a cached container client for the container named by the given environment variable."""
+    key = (container_env_var, use_connection_string)
+    if key not in _containers:
+        database = get_cosmos_client(use_connection_string).get_database_client(os.environ['COSMOS_DB_DATABASE'])
+        _containers[key] = database.get_container_client(os.environ[container_env_var])
+    return _containers[key]
+
+
+class RubricCache:
+    """Rubric documents keyed by (book_title, chapter, exercise), each kept for a fixed time to live."""
+
+    def __init__(self, ttl=RUBRIC_CACHE_TTL):
+        self.ttl = ttl
+        self.warmed = False
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return (found, rubric); a cached None means the rubric is known not to exist."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                return False, None
+            return True, entry[1]
+
+    def set(self, key, rubric):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, rubric)
+
+    def invalidate(self, key=None):
+        """Drop one rubric, or every rubric when no key is given."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self.warmed = False
+            else:
+                self._entries.pop(key, None)
+
+
+rubric_cache = RubricCache()
+
+
+def fetch_prompt(book_title, chapter, exercise):
+    key = (book_title, chapter, exercise)
+    found, rubric = rubric_cache.get(key)
+    if found:
+        metrics.increment('rubric_cache_hits')
+        return rubric
+    metrics.increment('rubric_cache_misses')
+
+    try:
+        container = get_container('COSMOS_DB_PROMPT_CONTAINER')
+
+        # Query to fetch the exercise
+        query = "SELECT * FROM c WHERE c.title=@book_title AND c.chapter=@chapter AND c.ex=@exercise"
+        parameters = [
+            {"name": "@book_title", "value": book_title},
+            {"name": "@chapter", "value": chapter},
+            {"name": "@exercise", "value": exercise}
+        ]
+        with metrics.span('fetch_prompt'):
+            items = list(container.query_items(
+                query=query,
+                parameters=parameters,
+                enable_cross_partition_query=True
+            ))
+
+        rubric = items[0] if items else None
+        rubric_cache.set(key, rubric)
+        return rubric
+
+    except CosmosHttpResponseError as e:
+        logging.error("Cosmos DB error: %s", str(e))
+        return None
+
+
+def warm_rubric_cache(book_titles):
+    """Bulk-load every rubric for the given book titles into the cache with a single query."""
+    try:
+        container = get_container('COSMOS_DB_PROMPT_CONTAINER')
+        items = container.query_items(
+            query="SELECT * FROM c WHERE ARRAY_CONTAINS(@titles, c.title)",
+            parameters=[{"name": "@titles", "value": list(book_titles)}],
+            enable_cross_partition_query=True
+        )
+        count = 0
+        for item in items:
+            rubric_cache.set((item['title'], item['chapter'], item['ex']), item)
+            count += 1
+        rubric_cache.warmed = True
+        logging.info("Warmed rubric cache with %d rubrics", count)
+    except CosmosHttpResponseError as e:
+        logging.error("Cosmos DB error: %s", str(e))
+
+
+def authenticate_user(username, password):
+    try:
+        container = get_container('COSMOS_DB_USER_CONTAINER', use_connection_string=True)
+
+        # Hash the password
+        hashed_password = hashlib.sha256(password.encode()).hexdigest()
+
+        # Query to authenticate the user
+        query = "SELECT * FROM c WHERE c.userid=@username AND c.password=@password"
+        parameters = [
+            {"name": "@username", "value": username},
+            {"name": "@password", "value": hashed_password}
+        ]
+
+        items = list(container.query_items(
+            query=query,
+            parameters=parameters,
+            enable_cross_partition_query=True
+        ))
+
+        return len(items) > 0
+
+    except CosmosHttpResponseError as e:
+        logging.error("Cosmos DB error: %s", str(e))
+        return False
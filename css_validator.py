@@ -1,15 +1,219 @@
-import cssutils
+import ast
 import logging
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from importlib.metadata import version
+
+# Bump when the report text changes, so cached reports in the old format are not reused
+CSS_REPORT_FORMAT = 4
+# Read from package metadata so cache keys can be built without importing cssutils
+CSS_VALIDATOR_VERSION = f"cssutils-{version('cssutils')}-report{CSS_REPORT_FORMAT}"
+# Style sheets are parsed in this many worker processes so parsing never holds the server's GIL; 0 parses in-process
+CSS_VALIDATOR_PROCESSES = int(os.environ.get('CSS_VALIDATOR_PROCESSES', str(min(4, os.cpu_count() or 1))))
+# Smaller style sheets parse faster than a round trip to a worker process
+CSS_VALIDATOR_INLINE_BYTES = int(os.environ.get('CSS_VALIDATOR_INLINE_BYTES', '4096'))
+
+# cssutils reports positions as a "[line:col: token]" suffix or as a token tuple "('CHAR', '{', line, col)"
+BRACKET_POSITION = re.compile(r'\s*\[(\d+):(\d+):[^\]]*\]\s*$')
+TOKEN_POSITION = re.compile(r"\('\w+', ('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"), (\d+), (\d+)\)")
+ALTERNATIVES = re.compile(r'Missing token for production Choice\([^)]*\)')
+SYNTAX_ERROR_IN = re.compile(r'Syntax Error in \w+: (.+)')
+# cssutils logs one mistake as several records: the first says what is wrong, these repeat it
+FOLLOW_ON = re.compile(r'No content to parse|Unknown syntax or no value|Syntax Error in \w+|Invalid Selector|No property value found')
+# Records that close a mistake's run; the next record starts a new one
+ENDS_RUN = re.compile(r'Syntax Error in \w+|Invalid Selector')
+# Errors in a value's tokens, which cssutils follows with "No content to parse."
+VALUE_ERROR = re.compile(r'^(Invalid token|\w*Value|FUNCTION):')
+
+_cssutils = None
+_records = {}
+_records_lock = threading.Lock()
+
+
+class _ThreadRecords(logging.Handler):
+    """Collect cssutils log records per thread, so concurrent parses keep their errors apart."""
+
+    def emit(self, record):
+        with _records_lock:
+            records = _records.get(record.thread)
+        if records is not None:
+            records.append(record.getMessage())
+
+
+def get_cssutils():
+    """Import cssutils on first use, routing its error log to _ThreadRecords instead of raising."""
+    global _cssutils
+    if _cssutils is None:
+        import cssutils
+        logger = logging.getLogger('css_validator.cssutils')
+        logger.setLevel(logging.ERROR)
+        logger.propagate = False
+        logger.addHandler(_ThreadRecords())
+        cssutils.log.setLog(logger)
+        cssutils.log.raiseExceptions = False
+        _cssutils = cssutils
+    return _cssutils
+
+
+def _parse_message(message):
+    """Split a cssutils message into (text, position): the text without token tuples or position suffix, position (line, column) or None."""
+    position = None
+    match = BRACKET_POSITION.search(message)
+    if match:
+        position = int(match.group(1)), int(match.group(2))
+        message = message[:match.start()]
+
+    def token_value(match):
+        nonlocal position
+        position = position or (int(match.group(2)), int(match.group(3)))
+        return ast.literal_eval(match.group(1))
+
+    message = TOKEN_POSITION.sub(token_value, message)
+    message = ALTERNATIVES.sub('Unexpected value', message)
+    # Keep the first line only: some messages append the rest of the style sheet
+    return ' '.join(message.split('\n')[0].split())[:200], position
+
+
+def _continues(run, text, position):
+    """Whether a record belongs to the open run: same position, or a follow-on without one."""
+    if position is not None:
+        return run['position'] == position
+    if text == 'No content to parse.':
+        return VALUE_ERROR.match(run['texts'][-1]) is not None
+    return True
+
+
+def _declaration_pattern(declaration):
+    """Match a whole declaration as cssutils quotes it ("color:", "margin 0"), up to the ";" or "}" that ends it.
+
+    Matching the name alone would find an earlier, valid declaration of the same property.
+    """
+    name, colon, value = declaration.strip().partition(':')
+    if not colon:
+        name, _, value = name.partition(' ')
+    pattern = re.escape(name.strip()) + (r'\s*:\s*' if colon else r'\s+') + r'\s+'.join(re.escape(word) for word in value.split())
+    return re.compile(r'(?<![\w-])' + pattern + r'(?=\s*(?:[;}]|$))')
+
+
+def _locate(source, texts, cursor):
+    """Find a run without a reported position by the declaration or value its messages quote, searching from cursor.
+
+    Returns (line, column, end offset of the quoted text) or None.
+    """
+    for text in texts:
+        match = SYNTAX_ERROR_IN.search(text)
+        if match:
+            found = _declaration_pattern(match.group(1)).search(source, cursor)
+            break
+    else:
+        match = re.search(r'.*: (.+)$', texts[0])
+        found = re.compile(re.escape(match.group(1).strip())).search(source, cursor) if match else None
+    if found is None:
+        return None
+    index = found.start()
+    return source.count('\n', 0, index) + 1, index - source.rfind('\n', 0, index), found.end()
+
+
+def css_errors(css_content):
+    """Parse a style sheet and return one (message, line, column) per mistake cssutils reports; line is None when unknown."""
+    cssutils = get_cssutils()
+    thread = threading.get_ident()
+    with _records_lock:
+        _records[thread] = messages = []
+    try:
+        # validate=False: the CSS 2.1 profiles would flag modern properties such as flex and grid
+        cssutils.CSSParser(raiseExceptions=False, validate=False).parseString(css_content)
+    finally:
+        with _records_lock:
+            del _records[thread]
+
+    runs = []
+    run = None
+    for message in messages:
+        text, position = _parse_message(message)
+        if run is not None and not run['closed'] and _continues(run, text, position):
+            run['texts'].append(text)
+        else:
+            run = {'texts': [text], 'position': position, 'closed': False}
+            runs.append(run)
+        run['closed'] = ENDS_RUN.search(text) is not None
+
+    line_starts = [0] + [match.end() for match in re.finditer('\n', css_content)]
+    errors = []
+    cursor = 0
+    for run in runs:
+        if run['position']:
+            line, column = run['position']
+            # cssutils reports where it gave up, which can be past the declaration a later run quotes,
+            # so search for that from the start of this line
+            cursor = line_starts[min(line, len(line_starts)) - 1]
+        else:
+            located = _locate(css_content, run['texts'], cursor)
+            if located is None and errors:
+                # Nothing to place it by: it is the tail of the previous mistake (e.g. a rule's missing "}")
+                continue
+            line, column, cursor = located or (None, None, cursor)
+        texts = [text for text in run['texts'] if not FOLLOW_ON.search(text)] or run['texts'][-1:]
+        error = (texts[0], line, column)
+        if not errors or errors[-1] != error:
+            errors.append(error)
+    return errors
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_process_pool():
+    """Return the shared pool of CSS parsing processes, started on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: forking a process that already runs threads (Streamlit, job workers) is unsafe
+            _pool = ProcessPoolExecutor(max_workers=CSS_VALIDATOR_PROCESSES, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def _reset_process_pool(broken):
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def format_css_errors(errors):
+    """Report errors like the HTML report in grader.syntax_check: one "Error: message at line N" per line."""
+    if not errors:
+        return "CSS is valid"
+    lines = []
+    for message, line, column in errors:
+        if line is None:
+            lines.append(f"Error: {message}\n")
+        elif column is None:
+            lines.append(f"Error: {message} at line {line}\n")
+        else:
+            lines.append(f"Error: {message} at line {line}, column {column}\n")
+    return ''.join(lines)
 
-cssutils.log.setLevel(logging.CRITICAL)  # To suppress non-critical logs
 
 def validate_css(file_path):
     with open(file_path, 'r') as file:
-        css_content = file.read()
+        return validate_css_source(file.read())
 
-    parser = cssutils.CSSParser(raiseExceptions=True)
+
+def validate_css_source(css_content):
+    """Validate a style sheet, in a worker process unless it is small, and return the formatted errors."""
+    if CSS_VALIDATOR_PROCESSES <= 0 or len(css_content) <= CSS_VALIDATOR_INLINE_BYTES:
+        return format_css_errors(css_errors(css_content))
+    pool = get_process_pool()
     try:
-        parser.parseString(css_content)
-        return "CSS is valid"
-    except Exception as e:
-        return f"CSS validation error: {e}"
+        return format_css_errors(pool.submit(css_errors, css_content).result())
+    except BrokenProcessPool:
+        logging.warning("CSS validator process pool failed, restarting it and validating in-process")
+        _reset_process_pool(pool)
+        return format_css_errors(css_errors(css_content))
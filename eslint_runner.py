@@ -1,8 +1,151 @@
+import json
+import logging
+import os
+import queue
+from collections import deque
+import shutil
 import subprocess
+import threading
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+JSHINT_CONFIG = os.path.join(BASE_DIR, '.jshintrc')
+JSHINT_WORKER_SCRIPT = os.path.join(BASE_DIR, 'jshint_worker.js')
+JSHINT_TIMEOUT = float(os.environ.get('JSHINT_TIMEOUT', '10'))
 
 def run_eslint(file_path):
     try:
         result = subprocess.run(['jshint', '--config', '.jshintrc', file_path], capture_output=True, text=True)
         return result.stdout if result.stdout else result.stderr
     except subprocess.CalledProcessError as e:
-        return str(e)
\ No newline at end of file
+        return str(e)
+
+
+class JSHintUnavailable(RuntimeError):
+    """Raised when the JSHint worker cannot be started (node or the jshint package is missing)."""
+
+
+class JSHintWorker:
+    """A long-lived node process that lints JavaScript sources sent over stdin, one JSON request per line."""
+
+    def __init__(self, config_path=JSHINT_CONFIG, timeout=JSHINT_TIMEOUT):
+        self.config_path = config_path
+        self.timeout = timeout
+        self._process = None
+        self._lines = None
+        self._stderr = None
+        self._stderr_reader = None
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def _start(self):
+        node = shutil.which('node')
+        if node is None:
+            raise JSHintUnavailable("node is not installed")
+        if not os.path.exists(self.config_path):
+            logging.warning("JSHint config %s not found, the worker lints with JSHint's defaults", self.config_path)
+        self._process = subprocess.Popen(
+            [node, JSHINT_WORKER_SCRIPT, self.config_path],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+            cwd=BASE_DIR,
+        )
+        # Read responses on a separate thread so a hung worker cannot block the caller past its timeout
+        self._lines = queue.Queue()
+        threading.Thread(target=self._read_lines, args=(self._process, self._lines), daemon=True).start()
+        # Drain stderr too: a full pipe would block node, and only its tail is needed to explain an exit
+        self._stderr = deque(maxlen=50)
+        stderr_reader = threading.Thread(target=self._read_stderr, args=(self._process, self._stderr), daemon=True)
+        stderr_reader.start()
+        self._stderr_reader = stderr_reader
+
+    @staticmethod
+    def _read_lines(process, lines):
+        for line in process.stdout:
+            lines.put(line)
+        lines.put(None)
+
+    @staticmethod
+    def _read_stderr(process, stderr):
+        for line in process.stderr:
+            stderr.append(line)
+
+    def _stop(self):
+        if self._process is not None:
+            self._process.kill()
+            self._process.wait()
+            self._process = None
+
+    def lint(self, sources):
+        """Lint {name: source} and return {name: [error dicts]} in a single round trip to the worker."""
+        with self._lock:
+            if self._process is None or self._process.poll() is not None:
+                self._start()
+            self._next_id += 1
+            request_id = self._next_id
+            try:
+                self._process.stdin.write(json.dumps({'id': request_id, 'files': sources}) + '\n')
+                self._process.stdin.flush()
+                line = self._lines.get(timeout=self.timeout)
+            except (BrokenPipeError, queue.Empty) as e:
+                self._stop()
+                raise RuntimeError(f"JSHint worker did not respond: {e!r}")
+
+            if line is None:
+                self._process.wait()
+                self._stderr_reader.join(timeout=1)
+                stderr = ''.join(self._stderr)
+                self._stop()
+                raise JSHintUnavailable(f"JSHint worker exited: {stderr.strip()}")
+
+            response = json.loads(line)
+            if response.get('id') != request_id:
+                self._stop()
+                raise RuntimeError(f"JSHint worker error: {response.get('error', 'mismatched response')}")
+            return response['results']
+
+    def close(self):
+        with self._lock:
+            self._stop()
+
+
+def format_jshint_errors(errors):
+    """Format JSHint errors like a compiler, keeping only syntax errors (E codes) and dropping warnings."""
+    report = ""
+    for error in errors:
+        if not str(error.get('code', '')).startswith('E'):
+            continue
+        report += f"Error: {error['reason']} at line {error['line']}, column {error['character']}"
+        if error.get('evidence'):
+            report += f": {error['evidence'].strip()}"
+        report += "\n"
+    return report
+
+
+_worker = JSHintWorker()
+_worker_available = None
+_probe_lock = threading.Lock()
+
+
+def jshint_available():
+    """Return whether the JSHint worker can be started, probing it once per process."""
+    global _worker_available
+    if _worker_available is None:
+        # Concurrent syntax checks wait for one probe instead of each starting (and logging) their own
+        with _probe_lock:
+            if _worker_available is None:
+                try:
+                    _worker.lint({})
+                    _worker_available = True
+                except Exception as e:
+                    logging.warning("JSHint worker unavailable, falling back to LLM JS checks: %s", str(e))
+                    _worker_available = False
+    return _worker_available
+
+
+def check_js_syntax(sources):
+    """Check {name: source} for syntax errors and return {name: compiler-style report}."""
+    results = _worker.lint(sources)
+    return {name: format_jshint_errors(results[name]) for name in sources}
@@ -1,58 +1,160 @@
 import zipfile
 import os
-from html_validator import validate_html_w3c
-from eslint_runner import run_eslint
-from css_validator import validate_css
-import shutil
-import tempfile
-import openai
+import logging
+import posixpath
+from html_validator import validate_html_source, validator_version
+from eslint_runner import run_eslint, check_js_syntax, jshint_available, JSHINT_CONFIG
+from css_validator import validate_css_source, CSS_VALIDATOR_VERSION
+from analysis_cache import cached_analysis, get_analysis_cache, make_key, Uncached
+from openai_pool import get_pool
+import metrics
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
 
 JS_PROMPT = """you are a javascript syntax evaluator/compiler, output only the error messages and the code that cause the error. Ignore any warning or 
 logical problem. In other words only output an error if there are syntax error. Assume that the javascript will be run by the browser, accept
 all browser globals. Do not provide suggestion to improve the code. Format your output like a compiler, but refer to the code snippet instead of
 line number and only return that output"""
+
+# 'jshint' lints JavaScript locally through a persistent node worker; 'llm' asks the model with JS_PROMPT
+JS_SYNTAX_BACKEND = os.environ.get('JS_SYNTAX_BACKEND', 'jshint')
+SYNTAX_CHECK_WORKERS = int(os.environ.get('SYNTAX_CHECK_WORKERS', '8'))
+SYNTAX_CHECK_TIMEOUT = float(os.environ.get('SYNTAX_CHECK_TIMEOUT', '60'))
+
+SOURCE_EXTENSIONS = ('.html', '.css', '.js')
+# Zip-bomb protection: limits on entry count, per-file and total uncompressed size, and compression ratio
+ZIP_MAX_ENTRIES = int(os.environ.get('ZIP_MAX_ENTRIES', '5000'))
+ZIP_MAX_FILE_BYTES = int(os.environ.get('ZIP_MAX_FILE_BYTES', str(2 * 1024 * 1024)))
+ZIP_MAX_TOTAL_BYTES = int(os.environ.get('ZIP_MAX_TOTAL_BYTES', str(20 * 1024 * 1024)))
+ZIP_MAX_COMPRESSION_RATIO = int(os.environ.get('ZIP_MAX_COMPRESSION_RATIO', '200'))
+
+class SubmissionRejected(ValueError):
+    """Raised when a submission ZIP exceeds the configured size or entry limits."""
+
 def process_zip(file):
-    temp_dir = tempfile.mkdtemp()
-    with zipfile.ZipFile(file, 'r') as zip_ref:
-        zip_ref.extractall(temp_dir)
-    return temp_dir
+    """Read the .html/.css/.js members of a submission ZIP into memory and return {filename: bytes}.
+
+    Other entries (images, fonts, node_modules...) are skipped without being decompressed.
+    """
+    sources = {}
+    total_bytes = 0
+    with metrics.span('process_zip'), zipfile.ZipFile(file, 'r') as zip_ref:
+        entries = zip_ref.infolist()
+        if len(entries) > ZIP_MAX_ENTRIES:
+            raise SubmissionRejected(f"ZIP has {len(entries)} entries (limit {ZIP_MAX_ENTRIES})")
+
+        for info in entries:
+            filename = posixpath.basename(info.filename)
+            if info.is_dir() or info.filename.startswith('__MACOSX/') or filename.startswith('.') \
+                    or not filename.endswith(SOURCE_EXTENSIONS):
+                continue
+
+            if info.file_size > ZIP_MAX_FILE_BYTES:
+                raise SubmissionRejected(f"{info.filename} is {info.file_size} bytes (limit {ZIP_MAX_FILE_BYTES})")
+            if info.compress_size and info.file_size / info.compress_size > ZIP_MAX_COMPRESSION_RATIO:
+                raise SubmissionRejected(f"{info.filename} has a suspicious compression ratio")
+            total_bytes += info.file_size
+            if total_bytes > ZIP_MAX_TOTAL_BYTES:
+                raise SubmissionRejected(f"ZIP source files exceed {ZIP_MAX_TOTAL_BYTES} bytes")
+
+            with zip_ref.open(info) as member:
+                # Never trust the header's declared size: read at most one byte past the limit
+                data = member.read(ZIP_MAX_FILE_BYTES + 1)
+            if len(data) > ZIP_MAX_FILE_BYTES:
+                raise SubmissionRejected(f"{info.filename} exceeds {ZIP_MAX_FILE_BYTES} bytes")
+            sources[filename] = data
+    return sources
+
+def read_submission_text(file):
+    """Return {filename: text} for a submission ZIP's source files, decoded the way syntax_check does."""
+    return {filename: content.decode('utf-8', errors='replace') for filename, content in process_zip(file).items()}
+
+def js_backend():
+    if JS_SYNTAX_BACKEND == 'jshint' and jshint_available():
+        return 'jshint'
+    return 'llm'
+
+def js_backend_version(backend, azure_openai_model):
+    if backend == 'jshint':
+        with open(JSHINT_CONFIG, 'r') as file:
+            return make_key('jshint', file.read())
+    return make_key(azure_openai_model, JS_PROMPT)
+
+def check_js(filename, source, azure_openai_model, backend):
+    with metrics.span('js_check', backend=backend):
+        if backend == 'jshint':
+            return check_js_syntax({filename: source})[filename]
+        messages = [{'role':'system', 'content':JS_PROMPT}]
+        messages.append({'role':'user', 'content':source})
+        return get_pool().chat_completion(messages)['choices'][0]['message']['content']
+
+def check_html(content):
+    with metrics.span('html_validate') as span:
+        html_validation_result = validate_html_source(content)
+        if isinstance(html_validation_result, dict):
+            span['validator'] = html_validation_result.get('validator')
+    if isinstance(html_validation_result, str):
+        # Raise rather than return so the failure is reported but never cached
+        raise RuntimeError(html_validation_result)
+    html_validation_feedback = ""
+    for message in html_validation_result['messages']:
+        if message['type'] == 'error' and 'lastLine' in message:
+            html_validation_feedback += f"Error: {message['message']} at line {message['lastLine']}\n"
+    if html_validation_result.get('validator') == 'local-fallback':
+        # The validator service was unavailable; report the offline result without caching it under the service's key
+        return Uncached(html_validation_feedback)
+    return html_validation_feedback
+
+def check_css(source):
+    with metrics.span('css_validate'):
+        return validate_css_source(source)
 
 def syntax_check(file, azure_openai_model):
-    temp_dir = process_zip(file)
+    with metrics.span('syntax_check'):
+        return _syntax_check(file, azure_openai_model)
+
+def _syntax_check(file, azure_openai_model):
+    sources = process_zip(file)
 
     grading_report = {}
     raw_file_text = {}
+    checks = {}
+    backend = js_backend()
+    js_version = js_backend_version(backend, azure_openai_model)
 
-    for dirpath, dirnames, filenames in os.walk(temp_dir):
-        for filename in filenames:
-            if filename.startswith('.') or (not filename.endswith('.js') and not filename.endswith('.css') and not filename.endswith('.html')):
-                continue
+    for filename, content in sources.items():
+        raw_file_text[filename] = content.decode('utf-8', errors='replace')
 
-            file_path = os.path.join(dirpath, filename)
-            with open(file_path, 'r') as file:
-                raw_file_text[filename] = file.read()
-
-            if filename.endswith('.js'):
-                # eslint_result = run_eslint(file_path)
-                messages = [{'role':'system', 'content':JS_PROMPT}]
-                messages.append({'role':'user', 'content':raw_file_text[filename]})
-                eslint_result = openai.ChatCompletion.create(
-                    messages=messages,
-                    engine=azure_openai_model, 
-                )['choices'][0]['message']['content']
-                grading_report[filename] = eslint_result
-            elif filename.endswith('.html'):
-                html_validation_result = validate_html_w3c(file_path)
-                html_validation_feedback = ""
-                for message in html_validation_result['messages']:
-                    if message['type'] == 'error' and 'lastLine' in message:
-                        html_validation_feedback += f"Error: {message['message']} at line {message['lastLine']}\n"
-                grading_report[filename] = html_validation_feedback
-            elif filename.endswith('.css'):
-                css_validation_result = validate_css(file_path)
-                grading_report[filename] = css_validation_result
-
-    # Clean up extracted files
-    shutil.rmtree(temp_dir)
+        # Identical file bodies checked by the same validator version are served from the analysis cache
+        if filename.endswith('.js'):
+            checks[filename] = (cached_analysis, 'js', js_version, raw_file_text[filename],
+                                partial(check_js, filename, raw_file_text[filename], azure_openai_model, backend))
+        elif filename.endswith('.html'):
+            checks[filename] = (cached_analysis, 'html', validator_version(), raw_file_text[filename],
+                                partial(check_html, content))
+        elif filename.endswith('.css'):
+            checks[filename] = (cached_analysis, 'css', CSS_VALIDATOR_VERSION, raw_file_text[filename],
+                                partial(check_css, raw_file_text[filename]))
+
+    # Run every per-file check concurrently against one deadline shared by the whole submission
+    executor = ThreadPoolExecutor(max_workers=max(1, min(SYNTAX_CHECK_WORKERS, len(checks))))
+    try:
+        futures = {filename: executor.submit(*check) for filename, check in checks.items()}
+        wait(futures.values(), timeout=SYNTAX_CHECK_TIMEOUT)
+        for filename in raw_file_text:
+            future = futures[filename]
+            if not future.done():
+                future.cancel()
+                logging.error("Syntax check timed out for %s", filename)
+                grading_report[filename] = f"Syntax check timed out after {SYNTAX_CHECK_TIMEOUT:g} seconds"
+                continue
+            try:
+                grading_report[filename] = future.result()
+            except Exception as e:
+                logging.error("Syntax check error for %s: %s", filename, str(e))
+                grading_report[filename] = f"Syntax check failed: {e}"
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
 
+    logging.info("Analysis cache: %s", get_analysis_cache().stats())
     return grading_report, raw_file_text
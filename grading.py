@@ -0,0 +1,152 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from analysis_cache import get_result_cache, key_lock, make_key
+from grader import syntax_check
+from openai_pool import get_pool
+from prompt_builder import build_prompt
+from grading_engine import astream_text, stream_text
+import metrics
+
+SYSTEM_PROMPT = """
+You are an auto grader for web programing courses. You will be given the student codes, compilation results and rubric as well as extra information if any.
+Do not be strict on comment and syntax style. For example if the task is to add the student name and date as a comment, accept any commenting style
+and any name and dates that are not placeholders. Example of placeholder that should not be accepted are 'first name last name', 'MM/DD/YYYY', 'your name', 'today's date'
+Example of acceptable name and date 'John Sminth', 'Hsung Tsai', '2/2/2000'. Remember, you can not verify the actual date and name or uploading task, so accept anything that is not an obvious placeholder;
+Acceot tasks that you do not have the tools to verify and note that you were not able to actually verify it.
+Fill out the rubric and provide justification for your grading. Refer to the line number with error when possible. Always show the achieved score in bold number. Never add up the total grade or do any math.
+Provide these extra information afterward when aplicable, like compile error, tips to manually grade this submission for instructor, feedback for student.\n
+Example:
+1. {First rubric item} [Possible Score:{First possible score}] .\n- **Score: 1/1** {Justification and reasoning}\n\n
+2. {Second rubric item} [Possible Score:{Second possible score}]\n- **Score: 2/3** {Justification and reasoning}\n\n
+3. {Third rubric item} [Possible Score:{Third possilbe score}]\n- **Score: 3/3** {Justification and reasoning}\n\n
+Addtional information: {Compile error}\n {Manual grading tips for instructor}\n {feedback for student}\n
+"""
+
+# Replaying a cached report streams it in pieces of this many characters, pausing between them
+REPLAY_CHUNK_CHARS = int(os.environ.get('RESULT_CACHE_REPLAY_CHUNK_CHARS', '40'))
+REPLAY_CHUNK_DELAY = float(os.environ.get('RESULT_CACHE_REPLAY_CHUNK_DELAY', '0'))
+
+def build_messages(grading_reports, raw_file_texts, prompt, stats=None):
+    """Assemble the chat messages for grading one submission against a rubric, within the prompt token budget."""
+    messages, prompt_stats = build_prompt(SYSTEM_PROMPT, grading_reports, raw_file_texts, prompt)
+    logging.info("Prompt uses %d of %d tokens (truncated: %s, vendored: %s, duplicates: %s)", prompt_stats['tokens'],
+                 prompt_stats['budget'], prompt_stats['truncated'], prompt_stats['vendored'], prompt_stats['duplicates'])
+    metrics.increment('prompt_tokens', prompt_stats['tokens'])
+    if stats is not None:
+        stats.update(prompt_stats)
+    return messages
+
+def result_key(messages, model):
+    """Key a grading result by everything that determines it: the normalised files, syntax reports,
+    rubric and system prompt (all carried by the messages) and the model."""
+    return make_key(model, json.dumps(messages, sort_keys=True))
+
+def replay_report(report):
+    """Yield a cached report in small pieces, like a completion stream."""
+    for start in range(0, len(report), REPLAY_CHUNK_CHARS):
+        if REPLAY_CHUNK_DELAY and start:
+            time.sleep(REPLAY_CHUNK_DELAY)
+        yield report[start:start + REPLAY_CHUNK_CHARS]
+
+async def areplay_report(report):
+    """replay_report for the event loop."""
+    for start in range(0, len(report), REPLAY_CHUNK_CHARS):
+        if REPLAY_CHUNK_DELAY and start:
+            await asyncio.sleep(REPLAY_CHUNK_DELAY)
+        yield report[start:start + REPLAY_CHUNK_CHARS]
+
+def _stream_finished(parts, key, started):
+    report = ''.join(parts)
+    metrics.record('llm_stream_total', time.perf_counter() - started, characters=len(report))
+    get_result_cache().set(key, report)
+
+def cache_stream(stream, key, started):
+    """Pass a stream's text deltas through, timing them and storing the full report once the stream completes."""
+    parts = []
+    for delta in stream_text(stream):
+        if not parts:
+            metrics.record('llm_first_token', time.perf_counter() - started)
+        parts.append(delta)
+        yield delta
+    _stream_finished(parts, key, started)
+
+async def acache_stream(stream, key, started):
+    """cache_stream for an async completion stream."""
+    parts = []
+    async for delta in astream_text(stream):
+        if not parts:
+            metrics.record('llm_first_token', time.perf_counter() - started)
+        parts.append(delta)
+        yield delta
+    _stream_finished(parts, key, started)
+
+def prepare_grading(file, prompt, stats=None):
+    """Syntax-check a submission and return its grading messages and result cache key."""
+    grading_reports, raw_file_texts = syntax_check(file, get_pool().model)
+    messages = build_messages(grading_reports, raw_file_texts, prompt, stats)
+    return messages, result_key(messages, get_pool().model)
+
+def complete_report(messages, key):
+    """Grade prepared messages with one non-streaming completion and store the report under key."""
+    with metrics.span('llm_completion'):
+        response = get_pool().chat_completion(messages)
+    report = response['choices'][0]['message']['content']
+    get_result_cache().set(key, report)
+    return report
+
+def grade_submission(file, prompt, stats=None, force=False):
+    try:
+        messages, key = prepare_grading(file, prompt, stats)
+        # Identical submissions graded at the same time (e.g. in one batch) wait for the first and reuse its report
+        with key_lock(key):
+            cached = None if force else get_result_cache().get(key)
+            if cached is not None:
+                logging.info("Serving grading report from the result cache")
+                return cached
+            return complete_report(messages, key)
+    except Exception as e:
+        logging.error("OpenAI API error: %s", str(e))
+        return "Error in grading (%s)" % str(e)
+
+def grade_submission_stream(file, prompt, stats=None, force=False):
+    """Return an iterator of report text deltas, or an error string.
+
+    Reports already graded for the same normalised submission and rubric are replayed from the
+    result cache unless force is set.
+    """
+    try:
+        messages, key = prepare_grading(file, prompt, stats)
+        cached = None if force else get_result_cache().get(key)
+        if cached is not None:
+            logging.info("Replaying grading report from the result cache")
+            return replay_report(cached)
+
+        started = time.perf_counter()
+        stream = get_pool().chat_completion(messages, stream=True)
+        return cache_stream(stream, key, started)
+    except Exception as e:
+        logging.error("OpenAI API error: %s", str(e))
+        return "Error in grading (%s)" % str(e)
+
+async def grade_submission_astream(file, prompt, stats=None, force=False):
+    """Async grade_submission_stream: returns an async iterator of report text deltas, or an error string.
+
+    The syntax check runs on a worker thread; the completion streams on the calling event loop,
+    so one thread can serve many concurrent gradings.
+    """
+    try:
+        messages, key = await asyncio.to_thread(prepare_grading, file, prompt, stats)
+        cached = None if force else get_result_cache().get(key)
+        if cached is not None:
+            logging.info("Replaying grading report from the result cache")
+            return areplay_report(cached)
+
+        started = time.perf_counter()
+        stream = await get_pool().achat_completion(messages, stream=True)
+        return acache_stream(stream, key, started)
+    except Exception as e:
+        logging.error("OpenAI API error: %s", str(e))
+        return "Error in grading (%s)" % str(e)
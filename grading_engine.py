@@ -0,0 +1,49 @@
+import os
+import time
+
+MAX_WORKERS = int(os.environ.get('GRADER_MAX_WORKERS', '4'))
+
+def stream_text(stream):
+    """Yield the text deltas of a streaming ChatCompletion response."""
+    for chunk in stream:
+        if chunk.choices and "content" in chunk.choices[0].delta:
+            yield chunk.choices[0].delta.content
+
+async def astream_text(stream):
+    """Yield the text deltas of an async streaming ChatCompletion response."""
+    async for chunk in stream:
+        if chunk.choices and "content" in chunk.choices[0].delta:
+            yield chunk.choices[0].delta.content
+
+class ThrottledBuffer:
+    """Collect streamed text and hand the full text to flush at most once per interval.
+
+    Deltas are kept in a list and joined only when flushing, so the work per stream grows
+    linearly with the report rather than once per delta.
+    """
+
+    def __init__(self, flush, interval):
+        self._flush = flush
+        self.interval = interval
+        self._parts = []
+        self._pending = False
+        self._last_flush = time.monotonic()
+
+    @property
+    def text(self):
+        if len(self._parts) > 1:
+            self._parts[:] = [''.join(self._parts)]
+        return self._parts[0] if self._parts else ''
+
+    def append(self, delta):
+        self._parts.append(delta)
+        self._pending = True
+        if time.monotonic() - self._last_flush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        """Flush now if anything arrived since the last flush."""
+        if self._pending:
+            self._flush(self.text)
+            self._pending = False
+        self._last_flush = time.monotonic()
@@ -1,13 +1,180 @@
+import logging
+import os
+import threading
+from html.parser import HTMLParser
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Point HTML_VALIDATOR_URL at a self-hosted Nu validator to avoid the public service's throttling
+W3C_VALIDATOR_URL = os.environ.get('HTML_VALIDATOR_URL', 'https://validator.w3.org/nu/?out=json')
+# 'nu' validates against HTML_VALIDATOR_URL, 'local' uses the in-process checker only
+HTML_VALIDATOR_BACKEND = os.environ.get('HTML_VALIDATOR_BACKEND', 'nu')
+HTML_VALIDATOR_FALLBACK = os.environ.get('HTML_VALIDATOR_FALLBACK', 'true').lower() == 'true'
+HTML_VALIDATOR_POOL_SIZE = int(os.environ.get('HTML_VALIDATOR_POOL_SIZE', '16'))
+HTML_VALIDATOR_RETRIES = int(os.environ.get('HTML_VALIDATOR_RETRIES', '3'))
+HTML_VALIDATOR_TIMEOUT = (
+    float(os.environ.get('HTML_VALIDATOR_CONNECT_TIMEOUT', '5')),
+    float(os.environ.get('HTML_VALIDATOR_READ_TIMEOUT', '30')),
+)
+
+LOCAL_VALIDATOR_VERSION = 'local-html-2'
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Return the shared keep-alive session used for every validator request."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=HTML_VALIDATOR_RETRIES,
+                backoff_factor=0.5,
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=['POST'],
+                respect_retry_after_header=True,
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(pool_connections=HTML_VALIDATOR_POOL_SIZE, pool_maxsize=HTML_VALIDATOR_POOL_SIZE, max_retries=retry)
+            _session = requests.Session()
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+            _session.headers['User-Agent'] = 'cengage-auto-grader'
+        return _session
 
-def validate_html_w3c(file_path):
-    url = 'https://validator.w3.org/nu/?out=json'
-    headers = {'Content-Type': 'text/html; charset=utf-8'}
 
+def validator_version():
+    """Identify the validator that will check HTML, for use in cache keys."""
+    if HTML_VALIDATOR_BACKEND == 'local':
+        return LOCAL_VALIDATOR_VERSION
+    return W3C_VALIDATOR_URL
+
+
+def validate_html_w3c(file_path):
     with open(file_path, 'rb') as file:
-        response = requests.post(url, headers=headers, data=file)
+        return validate_html_source(file.read())
+
 
-    if response.status_code == 200:
-        return response.json()
+def validate_html_source(content):
+    """Validate an HTML document (bytes) and return a Nu-style {'messages': [...]} result.
+
+    The result carries a 'validator' key naming the backend that produced it: 'nu', 'local', or
+    'local-fallback' when the Nu service failed and the local checker stood in. If the Nu
+    service fails and fallback is disabled, an error string is returned instead.
+    """
+    if HTML_VALIDATOR_BACKEND == 'local':
+        return validate_html_local(content)
+
+    headers = {'Content-Type': 'text/html; charset=utf-8'}
+    try:
+        response = get_session().post(W3C_VALIDATOR_URL, headers=headers, data=content, timeout=HTML_VALIDATOR_TIMEOUT)
+    except requests.RequestException as e:
+        logging.error("HTML validator request failed: %s", str(e))
+        error = f"Error in validation: {e}"
     else:
-        return f"Error in validation: {response.status_code}"
+        if response.status_code == 200:
+            result = response.json()
+            result['validator'] = 'nu'
+            return result
+        error = f"Error in validation: {response.status_code}"
+
+    if HTML_VALIDATOR_FALLBACK:
+        logging.warning("Falling back to the local HTML checker (%s)", error)
+        return dict(validate_html_local(content), validator='local-fallback')
+    return error
+
+
+# Elements that never have an end tag, and elements whose end tag may be omitted
+VOID_ELEMENTS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'}
+OPTIONAL_END_TAGS = {'html', 'head', 'body', 'p', 'li', 'dt', 'dd', 'tr', 'td', 'th', 'thead', 'tbody', 'tfoot',
+                     'colgroup', 'option', 'optgroup', 'rt', 'rp', 'caption'}
+# Inside these, elements follow XML rules: "/>" closes any element
+FOREIGN_ELEMENTS = {'svg', 'math'}
+
+
+class _LocalHTMLChecker(HTMLParser):
+    """Catch the structural errors students most often make: bad nesting, stray or missing end tags."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.messages = []
+        self.open_elements = []
+        self.ids = set()
+        self.seen_doctype = False
+        self.seen_title = False
+        self.seen_head = False
+
+    def report(self, message, line=None):
+        self.messages.append({'type': 'error', 'message': message, 'lastLine': line or self.getpos()[0]})
+
+    def handle_decl(self, decl):
+        if decl.lower().startswith('doctype'):
+            self.seen_doctype = True
+
+    def _check_start(self, tag, attrs):
+        if not self.seen_doctype:
+            self.report("Start tag seen without seeing a doctype first. Expected “<!DOCTYPE html>”.")
+            self.seen_doctype = True
+        attrs = dict(attrs)
+        element_id = attrs.get('id')
+        if element_id is not None:
+            if element_id in self.ids:
+                self.report(f"Duplicate ID “{element_id}”.")
+            self.ids.add(element_id)
+        if tag == 'img' and 'alt' not in attrs:
+            self.report("An “img” element must have an “alt” attribute, except under certain conditions.")
+        if tag == 'title':
+            self.seen_title = True
+        if tag == 'head':
+            self.seen_head = True
+
+    def handle_starttag(self, tag, attrs):
+        self._check_start(tag, attrs)
+        if tag not in VOID_ELEMENTS:
+            self.open_elements.append((tag, self.getpos()[0]))
+
+    def handle_startendtag(self, tag, attrs):
+        self._check_start(tag, attrs)
+        if tag in FOREIGN_ELEMENTS or any(name in FOREIGN_ELEMENTS for name, _ in self.open_elements):
+            return
+        if tag not in VOID_ELEMENTS:
+            self.report("Self-closing syntax (“/>”) used on a non-void HTML element. Ignoring the slash and treating as a start tag.")
+            self.open_elements.append((tag, self.getpos()[0]))
+
+    def handle_endtag(self, tag):
+        if tag in VOID_ELEMENTS or tag not in (name for name, _ in self.open_elements):
+            self.report(f"Stray end tag “{tag}”.")
+            return
+        unclosed = []
+        while self.open_elements:
+            name, line = self.open_elements.pop()
+            if name == tag:
+                break
+            if name not in OPTIONAL_END_TAGS:
+                unclosed.append((name, line))
+        if unclosed:
+            self.report(f"End tag “{tag}” seen, but there were open elements.")
+            for name, line in unclosed:
+                self.report(f"Unclosed element “{name}”.", line)
+
+    def finish(self):
+        self.close()
+        for name, line in self.open_elements:
+            if name not in OPTIONAL_END_TAGS:
+                self.report(f"Unclosed element “{name}”.", line)
+        if self.seen_head and not self.seen_title:
+            self.report("Element “head” is missing a required instance of child element “title”.")
+        self.messages.sort(key=lambda message: message['lastLine'])
+
+
+def validate_html_local(content):
+    """Check an HTML document (bytes or str) in-process, without any network service."""
+    if isinstance(content, bytes):
+        content = content.decode('utf-8', errors='replace')
+    checker = _LocalHTMLChecker()
+    checker.feed(content)
+    checker.finish()
+    return {'messages': checker.messages, 'validator': 'local'}
@@ -0,0 +1,136 @@
+import asyncio
+import io
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from analysis_cache import CACHE_DIR, make_key
+from grading import grade_submission_astream
+from grading_engine import MAX_WORKERS, ThrottledBuffer
+
+# How often a running job writes its partial report back to the store, which is also the UI's frame rate
+JOB_PROGRESS_INTERVAL = float(os.environ.get('JOB_PROGRESS_INTERVAL', '0.5'))
+JOB_RETENTION_SECONDS = float(os.environ.get('JOB_RETENTION_SECONDS', str(7 * 24 * 3600)))
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+FINISHED = (DONE, FAILED)
+
+
+def job_id(data, prompt):
+    """Jobs are identified by submission content and rubric, so resubmitting the same pair is a no-op."""
+    return make_key(data, prompt)
+
+
+class JobQueue:
+    """Grading jobs persisted in SQLite and run on a background event loop, independent of any UI session.
+
+    Completions stream on the loop, so a running job holds no thread while it waits for tokens.
+    """
+
+    def __init__(self, path, workers=MAX_WORKERS):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, file_name TEXT NOT NULL, status TEXT NOT NULL, data BLOB, prompt TEXT NOT NULL, "
+            "report TEXT NOT NULL DEFAULT '', error TEXT NOT NULL DEFAULT '', created REAL NOT NULL, updated REAL NOT NULL, "
+            "force INTEGER NOT NULL DEFAULT 0)"
+        )
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")]
+        if 'force' not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN force INTEGER NOT NULL DEFAULT 0")
+        self._loop = asyncio.new_event_loop()
+        self._slots = asyncio.Semaphore(max(1, workers))
+        threading.Thread(target=self._loop.run_forever, daemon=True, name='grading-jobs').start()
+        self._recover()
+
+    def _execute(self, query, parameters=()):
+        with self._lock:
+            return self._conn.execute(query, parameters).fetchall()
+
+    def _recover(self):
+        """Drop expired jobs and resume the ones a previous process left unfinished."""
+        self._execute("DELETE FROM jobs WHERE updated < ?", (time.time() - JOB_RETENTION_SECONDS,))
+        self._execute("UPDATE jobs SET status=?, report='' WHERE status=?", (QUEUED, RUNNING))
+        for (pending_id,) in self._execute("SELECT id FROM jobs WHERE status=? ORDER BY created", (QUEUED,)):
+            self._schedule(pending_id)
+
+    def submit(self, file_name, data, prompt, force=False):
+        """Queue a submission for grading and return its job id.
+
+        Queued and running jobs are never repeated; done jobs are only regraded when force is set,
+        which also bypasses the result cache.
+        """
+        new_id = job_id(data, prompt)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT status FROM jobs WHERE id=?", (new_id,)).fetchone()
+            if row is not None and (row[0] in (QUEUED, RUNNING) or (row[0] == DONE and not force)):
+                return new_id
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jobs (id, file_name, status, data, prompt, report, error, created, updated, force) "
+                "VALUES (?, ?, ?, ?, ?, '', '', ?, ?, ?)",
+                (new_id, file_name, QUEUED, data, prompt, now, now, int(force)),
+            )
+        self._schedule(new_id)
+        return new_id
+
+    def get(self, job_ids):
+        """Return {job_id: {'file_name', 'status', 'report', 'error'}} for the jobs that exist."""
+        job_ids = list(job_ids)
+        if not job_ids:
+            return {}
+        placeholders = ','.join('?' * len(job_ids))
+        rows = self._execute(f"SELECT id, file_name, status, report, error FROM jobs WHERE id IN ({placeholders})", job_ids)
+        return {row[0]: {'file_name': row[1], 'status': row[2], 'report': row[3], 'error': row[4]} for row in rows}
+
+    def _update(self, job, **fields):
+        fields['updated'] = time.time()
+        assignments = ', '.join(f"{name}=?" for name in fields)
+        self._execute(f"UPDATE jobs SET {assignments} WHERE id=?", (*fields.values(), job))
+
+    def _schedule(self, job):
+        asyncio.run_coroutine_threadsafe(self._run(job), self._loop)
+
+    async def _run(self, job):
+        async with self._slots:
+            rows = self._execute("SELECT file_name, data, prompt, force FROM jobs WHERE id=? AND status=?", (job, QUEUED))
+            if not rows:
+                return
+            file_name, data, prompt, force = rows[0]
+            self._update(job, status=RUNNING)
+            logging.info("Grading %s (job %s)", file_name, job[:12])
+
+            report = ThrottledBuffer(lambda text: self._update(job, report=text), JOB_PROGRESS_INTERVAL)
+            try:
+                stream = await grade_submission_astream(io.BytesIO(data), prompt, force=bool(force))
+                if isinstance(stream, str):
+                    raise RuntimeError(stream)
+                async for delta in stream:
+                    report.append(delta)
+            except Exception as e:
+                logging.error("Grading job %s for %s failed: %s", job[:12], file_name, str(e))
+                self._update(job, status=FAILED, report=report.text, error=str(e))
+                return
+            # The submission bytes are only needed until the job finishes
+            self._update(job, status=DONE, report=report.text, data=None)
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """Return the process-wide job queue, shared by every Streamlit session and rerun."""
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue(os.path.join(CACHE_DIR, 'jobs.sqlite3'))
+        return _job_queue
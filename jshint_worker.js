@@ -0,0 +1,49 @@
+'use strict';
+
+// Long-lived JSHint worker used by eslint_runner.JSHintWorker.
+// Reads one JSON request per line on stdin: {"id": 1, "files": {"name.js": "source"}}
+// and writes one JSON response per line on stdout: {"id": 1, "results": {"name.js": [errors]}}
+
+const fs = require('fs');
+const path = require('path');
+const readline = require('readline');
+const JSHINT = require('jshint').JSHINT;
+
+const configPath = process.argv[2] || path.join(__dirname, '.jshintrc');
+// A missing config must not disable the worker: lint with JSHint's defaults instead
+let config = {};
+if (fs.existsSync(configPath)) {
+  config = JSON.parse(fs.readFileSync(configPath, 'utf8'));
+} else {
+  process.stderr.write(`JSHint config ${configPath} not found, using JSHint defaults\n`);
+}
+const globals = config.globals || {};
+delete config.globals;
+
+function lint(source) {
+  JSHINT(source, Object.assign({}, config), Object.assign({}, globals));
+  return JSHINT.errors.filter(Boolean).map((error) => ({
+    line: error.line,
+    character: error.character,
+    code: error.code,
+    reason: error.reason,
+    evidence: error.evidence
+  }));
+}
+
+const input = readline.createInterface({ input: process.stdin, terminal: false });
+
+input.on('line', (line) => {
+  let response;
+  try {
+    const request = JSON.parse(line);
+    const results = {};
+    for (const name of Object.keys(request.files)) {
+      results[name] = lint(request.files[name]);
+    }
+    response = { id: request.id, results: results };
+  } catch (error) {
+    response = { id: null, error: String(error) };
+  }
+  process.stdout.write(JSON.stringify(response) + '\n');
+});
@@ -0,0 +1,126 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Append one JSON object per span to this file when set
+TRACE_FILE = os.environ.get('GRADER_TRACE_FILE')
+# Serve Prometheus text format on this port when set
+METRICS_PORT = os.environ.get('GRADER_METRICS_PORT')
+SAMPLES_PER_STAGE = int(os.environ.get('GRADER_METRICS_SAMPLES', '1000'))
+
+_lock = threading.Lock()
+_durations = defaultdict(lambda: deque(maxlen=SAMPLES_PER_STAGE))
+_counts = defaultdict(int)
+_counters = defaultdict(float)
+
+
+def record(stage, seconds, **attributes):
+    """Record one timed occurrence of a pipeline stage."""
+    with _lock:
+        _durations[stage].append(seconds)
+        _counts[stage] += 1
+    if TRACE_FILE:
+        line = json.dumps({'ts': time.time(), 'stage': stage, 'seconds': round(seconds, 6), **attributes}, default=str)
+        with _lock:
+            with open(TRACE_FILE, 'a', encoding='utf-8') as file:
+                file.write(line + '\n')
+
+
+@contextmanager
+def span(stage, **attributes):
+    """Time the enclosed block as one occurrence of stage; failures are recorded with error=<type>."""
+    start = time.perf_counter()
+    try:
+        yield attributes
+    except BaseException as e:
+        attributes['error'] = type(e).__name__
+        raise
+    finally:
+        record(stage, time.perf_counter() - start, **attributes)
+
+
+def increment(counter, amount=1):
+    """Add to a named counter, e.g. cache hits, retries or tokens sent."""
+    with _lock:
+        _counters[counter] += amount
+
+
+def _percentile(ordered, fraction):
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def summary():
+    """Return per-stage statistics over the most recent samples: count, p50, p95 and max in seconds."""
+    with _lock:
+        samples = {stage: sorted(durations) for stage, durations in _durations.items() if durations}
+        counts = dict(_counts)
+    return [
+        {
+            'stage': stage,
+            'count': counts[stage],
+            'p50': _percentile(ordered, 0.5),
+            'p95': _percentile(ordered, 0.95),
+            'max': ordered[-1],
+        }
+        for stage, ordered in sorted(samples.items())
+    ]
+
+
+def counters():
+    with _lock:
+        return dict(sorted(_counters.items()))
+
+
+def prometheus_text():
+    """Render the current metrics in the Prometheus text exposition format."""
+    lines = [
+        "# HELP grader_stage_seconds Duration of grading pipeline stages.",
+        "# TYPE grader_stage_seconds summary",
+    ]
+    for row in summary():
+        for quantile, key in (('0.5', 'p50'), ('0.95', 'p95')):
+            lines.append(f'grader_stage_seconds{{stage="{row["stage"]}",quantile="{quantile}"}} {row[key]:.6f}')
+        lines.append(f'grader_stage_seconds_count{{stage="{row["stage"]}"}} {row["count"]}')
+    lines.append("# HELP grader_events_total Counted pipeline events.")
+    lines.append("# TYPE grader_events_total counter")
+    for name, value in counters().items():
+        lines.append(f'grader_events_total{{event="{name}"}} {value:g}')
+    return '\n'.join(lines) + '\n'
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = prometheus_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+
+
+def start_metrics_server(port=METRICS_PORT):
+    """Serve prometheus_text() over HTTP on a background thread, once per process."""
+    global _server
+    with _lock:
+        if _server is not None or not port:
+            return
+        try:
+            _server = ThreadingHTTPServer(('0.0.0.0', int(port)), _MetricsHandler)
+        except OSError as e:
+            logging.error("Could not start metrics server on port %s: %s", port, str(e))
+            _server = False
+            return
+    threading.Thread(target=_server.serve_forever, daemon=True, name='metrics-server').start()
+    logging.info("Serving metrics on port %s", port)
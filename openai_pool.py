@@ -0,0 +1,353 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import openai
+from dotenv import load_dotenv
+
+import metrics
+
+# Securely load environment variables
+load_dotenv()
+
+API_VERSION = "2023-05-15"
+POOL_MAX_ATTEMPTS = int(os.environ.get('OPENAI_POOL_MAX_ATTEMPTS', '4'))
+POOL_ACQUIRE_TIMEOUT = float(os.environ.get('OPENAI_POOL_ACQUIRE_TIMEOUT', '120'))
+POOL_REQUEST_TIMEOUT = float(os.environ.get('OPENAI_POOL_REQUEST_TIMEOUT', '120'))
+POOL_BACKOFF_BASE = float(os.environ.get('OPENAI_POOL_BACKOFF_BASE', '1'))
+POOL_BACKOFF_MAX = float(os.environ.get('OPENAI_POOL_BACKOFF_MAX', '60'))
+
+ENDPOINT_MAX_CONCURRENT = int(os.environ.get('GRADER_ENDPOINT_MAX_CONCURRENT', '4'))
+ENDPOINT_REQUESTS_PER_MINUTE = int(os.environ.get('GRADER_ENDPOINT_REQUESTS_PER_MINUTE', '60'))
+ENDPOINT_TOKENS_PER_MINUTE = int(os.environ.get('GRADER_ENDPOINT_TOKENS_PER_MINUTE', '120000'))
+
+# Errors worth retrying on another endpoint: throttling, server errors and transport failures
+RETRYABLE_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.ServiceUnavailableError,
+    openai.error.APIConnectionError,
+    openai.error.Timeout,
+    openai.error.TryAgain,
+)
+
+
+def estimate_tokens(messages):
+    """Rough prompt size (about four characters per token) used for budgeting before a request is sent."""
+    return sum(len(message['content']) for message in messages) // 4 + 1
+
+
+def _is_retryable(error):
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    return isinstance(error, openai.error.APIError) and (error.http_status or 500) >= 500
+
+
+def _retry_after(error):
+    headers = getattr(error, 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after') or headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+class Endpoint:
+    """One Azure OpenAI deployment with its own concurrency, request and token budgets and health state."""
+
+    def __init__(self, name, api_base, api_key, model, weight=1.0, max_concurrent=ENDPOINT_MAX_CONCURRENT,
+                 requests_per_minute=ENDPOINT_REQUESTS_PER_MINUTE, tokens_per_minute=ENDPOINT_TOKENS_PER_MINUTE):
+        self.name = name
+        self.api_base = api_base
+        self.api_key = api_key
+        self.model = model
+        self.weight = weight
+        self.max_concurrent = max_concurrent
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.in_flight = 0
+        self.failures = 0
+        self.cooldown_until = 0.0
+        self.requests = deque()
+        self.tokens = deque()
+
+    def _trim(self, now):
+        while self.requests and self.requests[0] <= now - 60:
+            self.requests.popleft()
+        while self.tokens and self.tokens[0][0] <= now - 60:
+            self.tokens.popleft()
+
+    def can_accept(self, estimated_tokens, now):
+        self._trim(now)
+        if now < self.cooldown_until or self.in_flight >= self.max_concurrent:
+            return False
+        if self.requests_per_minute and len(self.requests) >= self.requests_per_minute:
+            return False
+        used_tokens = sum(count for _, count in self.tokens)
+        # An idle endpoint always accepts, so one oversized prompt cannot wait forever
+        return not self.tokens_per_minute or not self.tokens or used_tokens + estimated_tokens <= self.tokens_per_minute
+
+    def load(self):
+        return (self.in_flight + 1) / (self.max_concurrent * self.weight)
+
+    def stats(self):
+        return {
+            'name': self.name,
+            'in_flight': self.in_flight,
+            'requests_last_minute': len(self.requests),
+            'tokens_last_minute': sum(count for _, count in self.tokens),
+            'failures': self.failures,
+            'healthy': time.monotonic() >= self.cooldown_until,
+        }
+
+
+class EndpointPool:
+    """Route each ChatCompletion request to the least-loaded healthy endpoint, retrying elsewhere on 429/5xx."""
+
+    def __init__(self, endpoints, max_attempts=POOL_MAX_ATTEMPTS):
+        if not endpoints:
+            raise ValueError("No Azure OpenAI endpoints are configured")
+        self.endpoints = list(endpoints)
+        self.max_attempts = max_attempts
+        self._condition = threading.Condition()
+
+    @property
+    def model(self):
+        """The model name used to identify results (e.g. in cache keys).
+
+        Any endpoint may serve a request, so this names every deployment in the pool: a pool of
+        one model is keyed as that model, and a mixed pool never shares results with either model alone.
+        """
+        return '+'.join(sorted({endpoint.model for endpoint in self.endpoints}))
+
+    def _acquire(self, estimated_tokens, tried):
+        deadline = time.monotonic() + POOL_ACQUIRE_TIMEOUT
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                candidates = [endpoint for endpoint in self.endpoints if endpoint.can_accept(estimated_tokens, now)]
+                # Prefer endpoints this request has not failed on yet
+                untried = [endpoint for endpoint in candidates if endpoint.name not in tried]
+                candidates = untried or candidates
+                if candidates:
+                    endpoint = min(candidates, key=lambda candidate: (candidate.load(), random.random()))
+                    endpoint.in_flight += 1
+                    endpoint.requests.append(now)
+                    endpoint.tokens.append((now, estimated_tokens))
+                    return endpoint
+                if now >= deadline:
+                    raise openai.error.RateLimitError("All Azure OpenAI endpoints are busy or unhealthy")
+                # Wake up when a request finishes, or when a cooldown/budget window may have expired
+                self._condition.wait(timeout=min(1.0, deadline - now))
+
+    def _release(self, endpoint, error=None):
+        with self._condition:
+            endpoint.in_flight -= 1
+            if error is None:
+                endpoint.failures = 0
+            else:
+                endpoint.failures += 1
+                cooldown = _retry_after(error) or min(POOL_BACKOFF_MAX, POOL_BACKOFF_BASE * 2 ** (endpoint.failures - 1))
+                endpoint.cooldown_until = time.monotonic() + cooldown
+                logging.warning("Endpoint %s failed (%s), cooling down for %.1fs", endpoint.name, type(error).__name__, cooldown)
+            self._condition.notify_all()
+
+    def _record_usage(self, endpoint, response, estimated_tokens):
+        # The estimate was charged when the request started; charge whatever the completion added on top
+        usage = response.get('usage') if hasattr(response, 'get') else None
+        if usage and usage.get('total_tokens', 0) > estimated_tokens:
+            with self._condition:
+                endpoint.tokens.append((time.monotonic(), usage['total_tokens'] - estimated_tokens))
+
+    def _request(self, endpoint, messages, stream, kwargs):
+        return dict(
+            kwargs,
+            messages=messages,
+            engine=endpoint.model,
+            api_key=endpoint.api_key,
+            api_base=endpoint.api_base,
+            api_type="azure",
+            api_version=API_VERSION,
+            request_timeout=POOL_REQUEST_TIMEOUT,
+            stream=stream,
+        )
+
+    def _failed(self, endpoint, error, attempt):
+        """Release a failed request's slot; re-raise errors that another endpoint would not fix."""
+        if not _is_retryable(error):
+            self._release(endpoint)
+            raise error
+        self._release(endpoint, error)
+        metrics.increment('openai_retries')
+        metrics.increment(f"openai_errors_{endpoint.name}")
+        logging.info("Retrying ChatCompletion on another endpoint (attempt %d/%d)", attempt + 1, self.max_attempts)
+
+    def _succeeded(self, endpoint, estimated_tokens):
+        metrics.increment(f"openai_requests_{endpoint.name}")
+        metrics.increment('openai_prompt_tokens_estimated', estimated_tokens)
+
+    def chat_completion(self, messages, stream=False, **kwargs):
+        """Create a ChatCompletion on the best available endpoint.
+
+        With stream=True the returned iterator holds the endpoint's slot until it is exhausted or closed.
+        """
+        estimated_tokens = estimate_tokens(messages)
+        tried = set()
+        last_error = None
+        for attempt in range(self.max_attempts):
+            endpoint = self._acquire(estimated_tokens, tried)
+            tried.add(endpoint.name)
+            try:
+                response = openai.ChatCompletion.create(**self._request(endpoint, messages, stream, kwargs))
+            except Exception as e:
+                self._failed(endpoint, e, attempt)
+                last_error = e
+                continue
+
+            self._succeeded(endpoint, estimated_tokens)
+            if stream:
+                return _PooledStream(self, endpoint, response)
+            self._release(endpoint)
+            self._record_usage(endpoint, response, estimated_tokens)
+            return response
+        raise last_error
+
+    async def achat_completion(self, messages, stream=False, **kwargs):
+        """chat_completion for callers on an event loop, so many streams can share one thread.
+
+        Waiting for a free endpoint happens on a worker thread; with stream=True the returned
+        async iterator holds the endpoint's slot until it is exhausted or closed.
+        """
+        estimated_tokens = estimate_tokens(messages)
+        tried = set()
+        last_error = None
+        for attempt in range(self.max_attempts):
+            endpoint = await asyncio.to_thread(self._acquire, estimated_tokens, tried)
+            tried.add(endpoint.name)
+            try:
+                response = await openai.ChatCompletion.acreate(**self._request(endpoint, messages, stream, kwargs))
+            except Exception as e:
+                self._failed(endpoint, e, attempt)
+                last_error = e
+                continue
+
+            self._succeeded(endpoint, estimated_tokens)
+            if stream:
+                return _AsyncPooledStream(self, endpoint, response)
+            self._release(endpoint)
+            self._record_usage(endpoint, response, estimated_tokens)
+            return response
+        raise last_error
+
+    def stats(self):
+        with self._condition:
+            return [endpoint.stats() for endpoint in self.endpoints]
+
+
+class _PooledStream:
+    """Iterate a streaming response, returning its endpoint slot to the pool when exhausted, failed or closed."""
+
+    def __init__(self, pool, endpoint, response):
+        self._pool = pool
+        self._endpoint = endpoint
+        self._response = iter(response)
+        self._released = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._response)
+        except StopIteration:
+            self.close()
+            raise
+        except Exception as e:
+            self.close(e if _is_retryable(e) else None)
+            raise
+
+    def close(self, error=None):
+        if not self._released:
+            self._released = True
+            self._pool._release(self._endpoint, error)
+
+    def __del__(self):
+        self.close()
+
+
+class _AsyncPooledStream:
+    """Async counterpart of _PooledStream, for streams created by achat_completion."""
+
+    def __init__(self, pool, endpoint, response):
+        self._pool = pool
+        self._endpoint = endpoint
+        self._response = response
+        self._released = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self._response.__anext__()
+        except StopAsyncIteration:
+            await self.aclose()
+            raise
+        except Exception as e:
+            await self.aclose(e if _is_retryable(e) else None)
+            raise
+
+    async def aclose(self, error=None):
+        if not self._released:
+            self._released = True
+            self._pool._release(self._endpoint, error)
+            await self._response.aclose()
+
+    def __del__(self):
+        # Never awaited to the end: give the slot back, the response is closed with its session
+        if not self._released:
+            self._released = True
+            self._pool._release(self._endpoint)
+
+
+def load_endpoints():
+    """Read endpoints from AZURE_OPENAI_ENDPOINTS (a JSON list), or from the AZURE_OPENAI_*[_SUFFIX] variables.
+
+    Each JSON entry has 'endpoint', 'api_key' and 'model', and optionally 'name', 'weight',
+    'max_concurrent', 'requests_per_minute' and 'tokens_per_minute'.
+    """
+    configured = os.environ.get('AZURE_OPENAI_ENDPOINTS')
+    if configured:
+        endpoints = []
+        for index, entry in enumerate(json.loads(configured)):
+            options = {key: entry[key] for key in ('weight', 'max_concurrent', 'requests_per_minute', 'tokens_per_minute') if key in entry}
+            endpoints.append(Endpoint(entry.get('name', f"endpoint-{index}"), entry['endpoint'], entry['api_key'], entry['model'], **options))
+        return endpoints
+
+    # Legacy configuration: AZURE_OPENAI_ENDPOINT plus suffixed variants such as AZURE_OPENAI_ENDPOINT_UK
+    endpoints = []
+    for variable in sorted(os.environ):
+        if not variable.startswith('AZURE_OPENAI_ENDPOINT') or variable == 'AZURE_OPENAI_ENDPOINTS':
+            continue
+        suffix = variable[len('AZURE_OPENAI_ENDPOINT'):]
+        api_key = os.environ.get('AZURE_OPENAI_API_KEY' + suffix)
+        model = os.environ.get('AZURE_OPENAI_MODEL' + suffix)
+        if os.environ[variable] and api_key and model:
+            endpoints.append(Endpoint(suffix.lstrip('_') or 'default', os.environ[variable], api_key, model))
+    return endpoints
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide endpoint pool, built from the environment on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = EndpointPool(load_endpoints())
+        return _pool
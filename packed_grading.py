@@ -0,0 +1,206 @@
+import json
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from analysis_cache import get_result_cache
+from grading import SYSTEM_PROMPT, complete_report, prepare_grading
+from grading_engine import MAX_WORKERS
+from openai_pool import get_pool
+from prompt_builder import MESSAGE_OVERHEAD_TOKENS, PROMPT_TOKEN_BUDGET, count_tokens
+import metrics
+
+# Prompt tokens allowed for one packed request, and how many submissions it may carry
+PACK_TOKEN_BUDGET = int(os.environ.get('GRADER_PACK_TOKEN_BUDGET', str(PROMPT_TOKEN_BUDGET)))
+PACK_MAX_SUBMISSIONS = int(os.environ.get('GRADER_PACK_MAX_SUBMISSIONS', '5'))
+# Seconds one single-submission request takes, used to estimate the time packs save when this
+# process has not timed one
+PACK_BASELINE_SECONDS = float(os.environ['GRADER_PACK_BASELINE_SECONDS']) if os.environ.get('GRADER_PACK_BASELINE_SECONDS') else None
+
+PACKED_INSTRUCTIONS = """
+You will be given several student submissions for the same rubric, each starting with a line
+"=== Submission <id> ===". Grade every submission independently, exactly as you would grade it alone.
+Respond with a single JSON object and nothing else, in this form:
+{"reports": [{"id": "<id>", "report": "<the complete grading report for that submission, in markdown>"}]}
+Include one entry for every submission id.
+"""
+
+JSON_OBJECT = re.compile(r'\{.*\}', re.DOTALL)
+
+
+def submission_block(submission_id, messages):
+    """Render one submission's files and syntax reports (its single-grading messages minus the shared parts)."""
+    # messages is [system prompt, intro, ...files and syntax analyses..., rubric]
+    return '\n'.join([f"=== Submission {submission_id} ==="] + [message['content'] for message in messages[2:-1]])
+
+
+def packed_messages(prompt, blocks):
+    messages = [{"role": "system", "content": SYSTEM_PROMPT + PACKED_INSTRUCTIONS}]
+    messages.append({"role": "user", "content": "This is the rubric :" + prompt})
+    messages.extend({"role": "user", "content": block} for block in blocks)
+    return messages
+
+
+def message_tokens(messages):
+    return sum(count_tokens(message['content']) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+
+def plan_packs(costs, fixed_tokens, budget=PACK_TOKEN_BUDGET, max_submissions=PACK_MAX_SUBMISSIONS):
+    """Group names (in order) so each group's fixed_tokens plus block costs stays within budget."""
+    packs = []
+    current, used = [], fixed_tokens
+    for name, cost in costs.items():
+        if current and (used + cost > budget or len(current) >= max_submissions):
+            packs.append(current)
+            current, used = [], fixed_tokens
+        current.append(name)
+        used += cost
+    if current:
+        packs.append(current)
+    return packs
+
+
+def parse_packed_reports(text, expected_ids):
+    """Return {id: report} for the well-formed entries of a packed response.
+
+    Raises ValueError when the response is not the requested JSON object; entries with an
+    unknown id or an empty report are dropped, so the caller can regrade those submissions alone.
+    """
+    match = JSON_OBJECT.search(text)
+    if match is None:
+        raise ValueError("no JSON object in the response")
+    data = json.loads(match.group(0))
+    entries = data.get('reports') if isinstance(data, dict) else None
+    if not isinstance(entries, list):
+        raise ValueError("the response has no 'reports' list")
+    reports = {}
+    for entry in entries:
+        if not isinstance(entry, dict) or entry.get('id') not in expected_ids:
+            continue
+        report = entry.get('report')
+        if isinstance(report, str) and report.strip():
+            reports[entry['id']] = report.strip()
+    return reports
+
+
+def _grade_pack(number, names, prepared, prompt):
+    """Grade one pack; submissions missing from the packed response are graded on their own."""
+    ids = {f"S{index}": name for index, name in enumerate(names, start=1)}
+    start = time.perf_counter()
+
+    reports = {}
+    packed_tokens = 0
+    # A pack of one is just a single-submission request
+    if len(names) > 1:
+        messages = packed_messages(prompt, [submission_block(submission_id, prepared[name]['messages']) for submission_id, name in ids.items()])
+        packed_tokens = message_tokens(messages)
+        try:
+            with metrics.span('llm_packed_completion', submissions=len(names)):
+                response = get_pool().chat_completion(messages)
+            parsed = parse_packed_reports(response['choices'][0]['message']['content'], ids)
+            for submission_id, report in parsed.items():
+                reports[ids[submission_id]] = report
+                get_result_cache().set(prepared[ids[submission_id]]['key'], report)
+        except Exception as e:
+            logging.warning("Packed grading of %d submissions failed, grading them one at a time: %s", len(names), str(e))
+
+    fallbacks = [name for name in names if name not in reports]
+    results = {}
+    for name in names:
+        if name in reports:
+            results[name] = {'report': reports[name], 'mode': 'packed'}
+            continue
+        try:
+            results[name] = {'report': complete_report(prepared[name]['messages'], prepared[name]['key']), 'mode': 'single'}
+        except Exception as e:
+            logging.error("OpenAI API error: %s", str(e))
+            results[name] = {'report': "Error in grading (%s)" % str(e), 'mode': 'single'}
+    for result in results.values():
+        result['pack'] = number
+
+    # Fallback requests re-send their own prompt, so they count against the savings
+    single_tokens = sum(prepared[name]['stats']['tokens'] for name in names)
+    sent_tokens = packed_tokens + sum(prepared[name]['stats']['tokens'] for name in fallbacks)
+    metrics.increment('packed_tokens_saved', single_tokens - sent_tokens)
+    metrics.increment('packed_fallbacks', len(fallbacks))
+    return results, {
+        'pack': number,
+        'submissions': len(names),
+        'single_tokens': single_tokens,
+        'packed_tokens': sent_tokens,
+        'tokens_saved': single_tokens - sent_tokens,
+        'requests_saved': len(names) - len(fallbacks) - (1 if packed_tokens else 0),
+        'seconds': round(time.perf_counter() - start, 2),
+        'fallbacks': len(fallbacks),
+    }
+
+
+def _single_request_seconds():
+    """Median latency of single-submission completions (or else streamed gradings) seen by this process, if there were any."""
+    latencies = {row['stage']: row['p50'] for row in metrics.summary()}
+    return latencies.get('llm_completion', latencies.get('llm_stream_total'))
+
+
+def grade_packed(files, prompt, force=False, workers=MAX_WORKERS, budget=PACK_TOKEN_BUDGET, max_submissions=PACK_MAX_SUBMISSIONS):
+    """Grade submissions that share one rubric, several per completion request.
+
+    files maps a submission name to its ZIP (path or file object). Returns (results, packs):
+    results maps each name to {'report', 'prompt_tokens', 'mode', 'pack'}, where mode is
+    'packed', 'single' (graded alone: it did not fit a pack, or the packed answer for it was
+    unusable), 'cached' or 'error'. packs has one dict per pack with the prompt tokens sent compared
+    with grading each submission alone, and an estimate of the wall-clock time saved.
+    """
+    results = {}
+    prepared = {}
+
+    def prepare(name):
+        stats = {}
+        messages, key = prepare_grading(files[name], prompt, stats)
+        return {'messages': messages, 'key': key, 'stats': stats}
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for name, future in [(name, executor.submit(prepare, name)) for name in files]:
+            try:
+                prepared[name] = future.result()
+            except Exception as e:
+                logging.error("Could not prepare %s for grading: %s", name, str(e))
+                results[name] = {'report': "Error in grading (%s)" % str(e), 'prompt_tokens': 0, 'mode': 'error', 'pack': ''}
+
+    for name in list(prepared):
+        cached = None if force else get_result_cache().get(prepared[name]['key'])
+        if cached is not None:
+            results[name] = {'report': cached, 'prompt_tokens': prepared[name]['stats']['tokens'], 'mode': 'cached', 'pack': ''}
+            del prepared[name]
+
+    fixed_tokens = message_tokens(packed_messages(prompt, []))
+    costs = {name: count_tokens(submission_block('S00', item['messages'])) + MESSAGE_OVERHEAD_TOKENS for name, item in prepared.items()}
+    packs = plan_packs(costs, fixed_tokens, budget, max_submissions)
+
+    pack_stats = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = [executor.submit(_grade_pack, number, names, prepared, prompt) for number, names in enumerate(packs, start=1)]
+        for future in futures:
+            pack_results, stats = future.result()
+            for name, result in pack_results.items():
+                results[name] = dict(result, prompt_tokens=prepared[name]['stats']['tokens'])
+            pack_stats.append(stats)
+
+    # Grading a pack's submissions one after another would take about one single request each;
+    # that latency is known once this process has timed single-submission requests, or is configured
+    single_seconds = _single_request_seconds() or PACK_BASELINE_SECONDS
+    if single_seconds is None and pack_stats:
+        logging.warning("No single-submission request was timed, so the time saved by packing is unknown; "
+                        "set GRADER_PACK_BASELINE_SECONDS to estimate it")
+    for stats in pack_stats:
+        stats['estimated_seconds_saved'] = (
+            round(single_seconds * stats['submissions'] - stats['seconds'], 2) if single_seconds is not None else None
+        )
+        logging.info("Pack %d: %d submissions in %d prompt tokens instead of %d (%d saved), %.1fs, %d graded alone",
+                     stats['pack'], stats['submissions'], stats['packed_tokens'], stats['single_tokens'],
+                     stats['tokens_saved'], stats['seconds'], stats['fallbacks'])
+    if single_seconds is not None and pack_stats:
+        logging.info("Packing saved an estimated %.1fs against %.1fs per single-submission request",
+                     sum(stats['estimated_seconds_saved'] for stats in pack_stats), single_seconds)
+    return results, pack_stats
@@ -0,0 +1,178 @@
+import hashlib
+import logging
+import os
+import re
+
+try:
+    import tiktoken
+except ImportError:  # optional: fall back to a character-based estimate
+    tiktoken = None
+
+PROMPT_TOKEN_BUDGET = int(os.environ.get('GRADER_PROMPT_TOKEN_BUDGET', '12000'))
+# Tokens the chat format adds around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Third-party libraries students copy into their projects; they are never what the rubric grades.
+# A library name alone is not enough (students write my_bootstrap_theme.css or react-app.js): the file
+# name must also carry a version or .min suffix, as in jquery-3.6.0.js or bootstrap.bundle.min.css
+LIBRARY_FILE = re.compile(
+    r'(^|[-_.])(jquery|bootstrap|popper|lodash|underscore|angular|react|vue|modernizr|normalize|font-?awesome)'
+    r'([-_.].*)?\.(js|css)$',
+    re.IGNORECASE,
+)
+VERSIONED_FILE = re.compile(r'[-_.]v?\d+(\.\d+)+[-_.]|[-_.]min\.(js|css)$', re.IGNORECASE)
+VENDORED_BANNER = re.compile(r'/\*!?\s*(jQuery|Bootstrap|Lodash|normalize\.css|Font Awesome)|@license', re.IGNORECASE)
+MINIFIED_LINE_LENGTH = 500
+# Opening and closing tags of whitespace-preserving HTML elements, and unescaped template literal backticks
+PRESERVED_WHITESPACE = re.compile(r'<(?P<close>/?)(?P<tag>pre|textarea)\b|(?<!\\)`', re.IGNORECASE)
+
+_encoding = None
+
+
+def count_tokens(text):
+    """Count tokens with tiktoken when it is installed, otherwise estimate about four characters per token."""
+    global _encoding
+    if tiktoken is not None and _encoding is None:
+        try:
+            _encoding = tiktoken.get_encoding('cl100k_base')
+        except Exception as e:
+            logging.warning("tiktoken unavailable, estimating token counts: %s", str(e))
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def is_vendored(filename, text):
+    """Recognise bundled libraries by versioned or .min file name, license banner, or minified (very long) lines."""
+    library = LIBRARY_FILE.search(filename)
+    if library and VERSIONED_FILE.search(filename):
+        return True
+    head = text[:1000]
+    if VENDORED_BANNER.search(head):
+        return True
+    lines = text.splitlines() or ['']
+    minified = len(text) / len(lines) > MINIFIED_LINE_LENGTH
+    # Any minified file named after a library is one; otherwise only large ones, as students rarely minify
+    return minified and (library is not None or len(text) > 20000)
+
+
+def compact_whitespace(text):
+    """Drop trailing whitespace and shrink indentation to one space per level, keeping every line so line numbers still match.
+
+    Whitespace is part of the content inside <pre> and <textarea> blocks and JavaScript template
+    literals, so lines that start inside one are kept as they are.
+    """
+    lines = []
+    in_block = in_template = False
+    for line in text.splitlines():
+        started_inside = in_block or in_template
+        for match in PRESERVED_WHITESPACE.finditer(line):
+            if match.group('tag'):
+                if not in_template:
+                    in_block = not match.group('close')
+            elif not in_block:
+                in_template = not in_template
+        if started_inside:
+            lines.append(line)
+            continue
+        stripped = line.lstrip(' \t')
+        indent = len(line[:len(line) - len(stripped)].expandtabs(4))
+        lines.append(' ' * (indent // 4 or (1 if indent else 0)) + (stripped if in_block or in_template else stripped.rstrip()))
+    return '\n'.join(lines)
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Keep the head and tail of text within max_tokens, marking which lines were left out."""
+    if count_tokens(text) <= max_tokens:
+        return text, False
+    lines = text.splitlines()
+    head, tail = [], []
+    used = count_tokens("[... lines 000000-000000 omitted to fit the grading budget ...]")
+    # Fill two thirds of the budget from the top of the file and the rest from the bottom
+    for line in lines:
+        cost = count_tokens(line) + 1
+        if used + cost > max_tokens * 2 // 3:
+            break
+        head.append(line)
+        used += cost
+    for line in reversed(lines[len(head):]):
+        cost = count_tokens(line) + 1
+        if used + cost > max_tokens:
+            break
+        tail.insert(0, line)
+        used += cost
+    first_omitted = len(head) + 1
+    last_omitted = len(lines) - len(tail)
+    marker = f"[... lines {first_omitted}-{last_omitted} omitted to fit the grading budget ...]"
+    return '\n'.join(head + [marker] + tail), True
+
+
+def _fit_budgets(sizes, available):
+    """Split available tokens between files: small files keep everything, large ones share what is left equally."""
+    budgets = {}
+    remaining = dict(sizes)
+    while remaining:
+        share = max(available, 0) // len(remaining)
+        fitting = {name: size for name, size in remaining.items() if size <= share}
+        if not fitting:
+            for name in remaining:
+                budgets[name] = share
+            break
+        for name, size in fitting.items():
+            budgets[name] = size
+            available -= size
+            del remaining[name]
+    return budgets
+
+
+def build_prompt(system_prompt, grading_reports, raw_file_texts, rubric, budget=PROMPT_TOKEN_BUDGET):
+    """Assemble the grading messages within a token budget.
+
+    Vendored libraries are replaced by a note, identical files are sent once, whitespace is
+    compacted, and files are truncated (head and tail kept) when the total would exceed the budget.
+    Returns (messages, stats), where stats records the tokens used and what was left out.
+    """
+    stats = {'budget': budget, 'vendored': [], 'duplicates': [], 'truncated': []}
+    files = {}
+    seen = {}
+    for filename, text in raw_file_texts.items():
+        digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        if digest in seen:
+            files[filename] = (f"[Identical to {seen[digest]}]", False)
+            stats['duplicates'].append(filename)
+        elif is_vendored(filename, text):
+            files[filename] = (f"[Third-party library omitted: {len(text.splitlines())} lines]", False)
+            stats['vendored'].append(filename)
+        else:
+            seen[digest] = filename
+            files[filename] = (compact_whitespace(text), True)
+
+    def assemble(contents):
+        messages = [{"role": "system", "content": system_prompt}]
+        messages.append({"role": "user", "content": "You are grading the following file(s):"})
+        for filename in raw_file_texts:
+            messages.append({"role": "user", "content": f"File: {filename}"})
+            messages.append({"role": "user", "content": contents[filename]})
+            if grading_reports.get(filename, "") != "" and filename not in stats['vendored']:
+                messages.append({"role": "system", "content": "This is a syntax analysis of the file" + grading_reports[filename]})
+        messages.append({"role": "user", "content": "This is the rubric :" + rubric})
+        return messages
+
+    contents = {filename: content for filename, (content, _) in files.items()}
+    messages = assemble(contents)
+    per_message = [count_tokens(message['content']) + MESSAGE_OVERHEAD_TOKENS for message in messages]
+
+    if sum(per_message) > budget:
+        file_tokens = {filename: count_tokens(content) for filename, (content, gradable) in files.items() if gradable}
+        fixed = sum(per_message) - sum(file_tokens.values())
+        for filename, file_budget in _fit_budgets(file_tokens, budget - fixed).items():
+            contents[filename], truncated = truncate_to_tokens(contents[filename], file_budget)
+            if truncated:
+                stats['truncated'].append(filename)
+        messages = assemble(contents)
+        per_message = [count_tokens(message['content']) + MESSAGE_OVERHEAD_TOKENS for message in messages]
+
+    stats['per_message'] = per_message
+    stats['tokens'] = sum(per_message)
+    return messages, stats